@@ -0,0 +1,134 @@
+"""
+Times sightright --analytics on a synthetic answer history: loading the
+answers into NumPy arrays, then the grouped NumPy statistics, against the
+same per-phrase and per-batch means and standard deviations worked out in a
+plain Python loop over the rows. With --archived, that fraction of the
+answers is first moved into the archive file with sightright's archiving,
+so both read it too.
+
+    python3 benchmarks/bench_analytics.py [--rows 10000000] [--phrases 500] [--archived 0.5]
+"""
+import argparse
+import csv
+import gzip
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sightright
+
+def build_database(directory, num_of_rows, num_of_phrases, batch_size):
+    conn = sightright.connect_database(directory)
+    cur = conn.cursor()
+    sightright.setup_database(cur, conn)
+    cur.executemany('INSERT INTO phrases (phrase, list, enabled) VALUES (?, ?, 1)',
+                    (("phrase %d" % i, "benchmark") for i in range(num_of_phrases)))
+    cur.executemany('INSERT INTO batches (batch_id, learner_id) VALUES (?, ?)',
+                    ((i, sightright.DEFAULT_LEARNER_ID) for i in range(1, num_of_rows // batch_size + 2)))
+    # Each phrase gets its own typical answer time so there is something to rank
+    typical_ms = [random.uniform(500, 3000) for i in range(num_of_phrases)]
+    def rows():
+        for i in range(num_of_rows):
+            phrase_index = random.randrange(num_of_phrases)
+            yield (i // batch_size + 1, phrase_index + 1, int(random.gauss(typical_ms[phrase_index], 300)) if random.random() > 0.001 else 20000,
+                   "Correct" if random.random() < 0.8 else "Incorrect", sightright.DEFAULT_LEARNER_ID)
+    cur.executemany('INSERT INTO response_history (batch_id, phrase_id, response_time_ms, response_status, learner_id) VALUES (?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    return conn
+
+def archive_rows(cur, conn, archived, archive_file_name):
+    """
+    Archives the answers of the first archived fraction of the batches
+    Returns the number of answers archived
+    """
+    cur.execute('SELECT max(batch_id) FROM batches')
+    last_archived_batch = int(cur.fetchone()[0] * archived)
+    cur.execute("UPDATE batches SET start_time = CASE WHEN batch_id <= ? THEN '2000-01-01 00:00:00' ELSE '2030-01-01 00:00:00' END", (last_archived_batch,))
+    conn.commit()
+    return sightright.archive_responses(cur, conn, '2020-01-01', archive_file_name)
+
+def iter_python_rows(cur, archive_file_name):
+    """
+    Yields (phrase_id, batch_id, time_ms, correct) for each timed answer,
+    archived and live, one row at a time
+    """
+    if os.path.exists(archive_file_name):
+        with gzip.open(archive_file_name, 'rt', newline='') as archive_file:
+            for row in csv.reader(archive_file):
+                if row[0] != 'response_id' and row[3] and int(row[7]) == sightright.DEFAULT_LEARNER_ID:
+                    yield (int(row[2]), int(row[1]), float(row[3]), row[4] == "Correct")
+    cur.execute("SELECT phrase_id, batch_id, response_time_ms, response_status = 'Correct' FROM response_history WHERE +learner_id = ? AND response_time_ms IS NOT NULL", (sightright.DEFAULT_LEARNER_ID,))
+    yield from cur
+
+def python_analysis(cur, archive_file_name):
+    """
+    The per-phrase and per-batch means and standard deviations, one row at
+    a time
+    Returns the number of phrases seen
+    """
+    phrases = {}
+    batches = {}
+    for phrase_id, batch_id, time_ms, correct in iter_python_rows(cur, archive_file_name):
+        totals = phrases.get(phrase_id)
+        if totals == None:
+            totals = phrases[phrase_id] = [0, 0.0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += time_ms
+        totals[2] += time_ms * time_ms
+        totals[3] += correct
+        batch_totals = batches.get(batch_id)
+        if batch_totals == None:
+            batch_totals = batches[batch_id] = [0, 0.0]
+        batch_totals[0] += 1
+        batch_totals[1] += time_ms
+    for totals in phrases.values():
+        mean = totals[1] / totals[0]
+        totals.append(math.sqrt(max(totals[2] / totals[0] - mean * mean, 0)))
+    return len(phrases)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NumPy answer time analytics')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--phrases', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=30)
+    parser.add_argument('--archived', type=float, default=0.0, help='Fraction of the answers to archive first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-python', action='store_true', help='Skip the plain Python comparison')
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        conn = build_database(directory, options.rows, options.phrases, options.batch_size)
+        print("%-26s %9.2f s" % ("build database", time.perf_counter() - start))
+        cur = conn.cursor()
+        archive_file_name = os.path.join(directory, 'archive', sightright.ARCHIVE_FILE_NAME)
+        if options.archived > 0:
+            start = time.perf_counter()
+            archived = archive_rows(cur, conn, options.archived, archive_file_name)
+            print("%-26s %9.2f s  (%d rows)" % ("archive", time.perf_counter() - start, archived))
+
+        start = time.perf_counter()
+        columns = sightright.load_response_columns(cur, archive_file_name=archive_file_name)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        results = sightright.analyse_responses(columns)
+        analyse_time = time.perf_counter() - start
+        column_bytes = sum(column.nbytes for column in columns.values())
+
+        print("%-26s %9.2f s  (%d rows, %.1f MB of columns)" % ("numpy: load columns", load_time, len(columns['time_ms']), column_bytes / 1000000))
+        print("%-26s %9.2f s  (%d phrases, %d batches)" % ("numpy: analyse", analyse_time, len(results['phrase_id']), len(results['batch_id'])))
+
+        if not options.skip_python:
+            start = time.perf_counter()
+            python_analysis(cur, archive_file_name)
+            print("%-26s %9.2f s" % ("python: load and analyse", time.perf_counter() - start))
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Times the database helpers the game and admin commands use, one query at a
+time, on a connection opened with SQLite's defaults (rollback journal,
+synchronous=FULL, no memory map) against one from
+sightright.connect_database(). Also compares looking up a phrase with the
+text pasted into the SQL, which has to be compiled every time, against a ?
+parameter, which is compiled once and then served from the statement cache.
+
+    python3 benchmarks/bench_database.py [--repeat 500] [--phrases 1000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sightright
+
+def build_database(conn, num_of_phrases):
+    cur = conn.cursor()
+    sightright.setup_database(cur, conn)
+    cur.executemany('INSERT INTO phrases (phrase, list, enabled) VALUES (?, ?, 1)',
+                    (("phrase %d" % i, "benchmark") for i in range(num_of_phrases)))
+    conn.commit()
+    return cur
+
+def time_us(function, repeat):
+    """
+    Returns the mean time of a call to function() in microseconds
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    return (time.perf_counter() - start) / repeat * 1000000
+
+def bench_queries(cur, conn, repeat, num_of_phrases):
+    """
+    Returns a list of (query, mean microseconds per call)
+    """
+    results = []
+    results.append(("log_phrase_result", time_us(
+        lambda i: sightright.log_phrase_result(cur, conn, 1, random.randint(1, num_of_phrases), random.randint(300, 6000), "Correct", 1.0, 500.0), repeat)))
+    results.append(("get_phrase_batch", time_us(
+        lambda i: sightright.get_phrase_batch(cur, conn, 30), max(repeat // 10, 1))))
+    results.append(("disable_phrase", time_us(
+        lambda i: sightright.disable_phrase(cur, conn, random.randint(1, num_of_phrases)), repeat)))
+    results.append(("add_phrase_to_database", time_us(
+        lambda i: sightright.add_phrase_to_database(cur, conn, "new phrase %d %d" % (i, random.random() * 1000000), "benchmark"), repeat)))
+
+    def lookup_interpolated(i):
+        cur.execute("SELECT phrase_id FROM phrases WHERE phrase = 'phrase %d'" % random.randint(0, num_of_phrases - 1))
+        cur.fetchone()
+    def lookup_parameterized(i):
+        cur.execute("SELECT phrase_id FROM phrases WHERE phrase = ?", ("phrase %d" % random.randint(0, num_of_phrases - 1),))
+        cur.fetchone()
+    results.append(("phrase lookup, interpolated", time_us(lookup_interpolated, repeat * 10)))
+    results.append(("phrase lookup, ? parameter", time_us(lookup_parameterized, repeat * 10)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark database helpers on default and tuned connections')
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--phrases', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        random.seed(options.seed)
+        default_conn = sqlite3.connect(os.path.join(directory, "default.db"))
+        default_results = bench_queries(build_database(default_conn, options.phrases), default_conn, options.repeat, options.phrases)
+        default_conn.close()
+
+        random.seed(options.seed)
+        tuned_conn = sightright.connect_database(directory)
+        tuned_results = bench_queries(build_database(tuned_conn, options.phrases), tuned_conn, options.repeat, options.phrases)
+        tuned_conn.close()
+
+    print("synchronous=%s, mmap_size=%d" % (sightright.database_synchronous, sightright.DATABASE_MMAP_SIZE))
+    print("%-30s %12s %12s %9s" % ("query", "default", "tuned", "speed-up"))
+    for (query, default_us), (tuned_query, tuned_us) in zip(default_results, tuned_results):
+        print("%-30s %9.1f us %9.1f us %8.1fx" % (query, default_us, tuned_us, default_us / tuned_us))
+
+if __name__ == '__main__':
+    main()
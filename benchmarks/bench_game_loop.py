@@ -0,0 +1,220 @@
+"""
+Drives sightright.game_loop() headlessly (SDL dummy video driver, no window)
+with synthetic key presses, and reports per-state timings, frame render
+percentiles and database write throughput as JSON.
+
+    python3 benchmarks/bench_game_loop.py [--rounds 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sightright
+pygame = sightright.load_pygame()
+
+ANSWER_KEYS = [pygame.K_UP, pygame.K_DOWN, pygame.K_RIGHT]
+
+def percentiles(samples):
+    """
+    Returns a summary of a list of timings in ms: count, mean and the 50th,
+    90th, 99th percentiles and maximum
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.mean(ordered),
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': ordered[-1],
+    }
+
+def build_database(directory, num_of_phrases):
+    conn = sightright.connect_database(directory)
+    cur = conn.cursor()
+    sightright.setup_database(cur, conn)
+    rows = (("phrase %d" % i, "benchmark") for i in range(num_of_phrases))
+    cur.executemany('INSERT INTO phrases (phrase, list, enabled) VALUES (?, ?, 1)', rows)
+    conn.commit()
+    return conn
+
+def synthetic_events():
+    """
+    Stands in for sightright.get_game_events(): answers whatever the current
+    state is waiting for straight away, so the loop never sleeps and only
+    the work done in each state is measured
+    """
+    state = sightright.game_state
+    sightright.last_event_time = time.monotonic()
+    if state == sightright.BATCH_START:
+        return [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE)]
+    if state == sightright.ACCEPT_INPUT:
+        return [pygame.event.Event(pygame.KEYDOWN, key=random.choice(ANSWER_KEYS))]
+    if state == sightright.DISPLAY_WAIT:
+        return [pygame.event.Event(pygame.USEREVENT + 1)]
+    return [pygame.event.Event(pygame.QUIT)]
+
+def bench_game_loop(directory, conn, rounds, batch_size):
+    """
+    Plays rounds of batch_size words through game_loop()
+    Returns (state timings, frame render timings), both in ms
+    """
+    state_timings = {}
+    frame_timings = []
+
+    start_cpu_measurement = sightright.start_cpu_measurement
+    stop_cpu_measurement = sightright.stop_cpu_measurement
+    update_display = sightright.update_display
+
+    def timed_stop_cpu_measurement():
+        if sightright.cpu_measurement != None:
+            state, wall_start_time, cpu_start_time = sightright.cpu_measurement
+            state_timings.setdefault(sightright.GAME_STATE_NAMES[state], []).append((time.monotonic() - wall_start_time) * 1000)
+        stop_cpu_measurement()
+
+    def timed_update_display():
+        render_start_time = time.perf_counter()
+        update_display()
+        frame_timings.append((time.perf_counter() - render_start_time) * 1000)
+
+    sightright.get_game_events = synthetic_events
+    sightright.stop_cpu_measurement = timed_stop_cpu_measurement
+    sightright.update_display = timed_update_display
+    sightright.measure_cpu = True
+
+    cur = conn.cursor()
+    # game_loop() finishes each batch through the game's own connection
+    sightright.cursor = cur
+    sightright.connection = conn
+    sightright.learners = sightright.get_learners(cur)
+    sightright.current_learner = 0
+    for round_number in range(rounds):
+        sightright.phrases = sightright.get_phrase_batch(cur, conn, batch_size)
+        sightright.total_words = len(sightright.phrases)
+        sightright.current_phrase_number = 0
+        sightright.score = 0
+        sightright.words_attempted = 0
+        sightright.current_phrase = sightright.phrases[0]
+        sightright.response_log = sightright.response_writer(directory)
+        sightright.game_state = sightright.BATCH_START
+        sightright.update_display()
+        try:
+            sightright.game_loop()
+        except SystemExit:
+            # The synthetic QUIT at BATCH_END ends the round
+            pass
+
+    sightright.start_cpu_measurement = start_cpu_measurement
+    sightright.stop_cpu_measurement = stop_cpu_measurement
+    sightright.update_display = update_display
+    sightright.measure_cpu = False
+    return state_timings, frame_timings
+
+def bench_database_writes(directory, conn, num_of_answers, write_batch_size):
+    """
+    Measures how many answers per second can be recorded: one commit per
+    answer with log_phrase_result(), batched with record_responses(), and
+    through the background response_writer the game uses
+    Returns a dictionary of answers per second
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT phrase_id FROM phrases')
+    phrase_ids = [row[0] for row in cur.fetchall()]
+
+    def answers(count):
+        return [(0, random.choice(phrase_ids), random.randint(300, 6000), random.choice(["Correct", "Incorrect"]), 1.0, 500.0, sightright.DEFAULT_LEARNER_ID) for i in range(count)]
+
+    results = {}
+
+    single = answers(num_of_answers)
+    start = time.perf_counter()
+    for response in single:
+        sightright.log_phrase_result(cur, conn, *response)
+    results['log_phrase_result_per_s'] = num_of_answers / (time.perf_counter() - start)
+
+    batched = answers(num_of_answers)
+    start = time.perf_counter()
+    for i in range(0, num_of_answers, write_batch_size):
+        sightright.record_responses(cur, conn, batched[i:i + write_batch_size])
+    results['record_responses_per_s'] = num_of_answers / (time.perf_counter() - start)
+
+    writer = sightright.response_writer(directory)
+    queued = answers(num_of_answers)
+    start = time.perf_counter()
+    for response in queued:
+        writer.log(*response)
+    queued_time = time.perf_counter() - start
+    writer.flush()
+    results['response_writer_per_s'] = num_of_answers / (time.perf_counter() - start)
+    results['response_writer_queue_per_s'] = num_of_answers / max(queued_time, 0.000001)
+    writer.close()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game loop, rendering and answer logging headlessly')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=30)
+    parser.add_argument('--phrases', type=int, default=1000)
+    parser.add_argument('--answers', type=int, default=1000,
+                        help='Number of answers to write for each database write benchmark')
+    parser.add_argument('--write-batch-size', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON results to this file instead of standard output')
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+
+    pygame.init()
+    sightright.game_display = pygame.display.set_mode((sightright.display_width, sightright.display_height))
+    sightright.controls_font = pygame.font.Font('freesansbold.ttf', 20)
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = build_database(directory, options.phrases)
+        state_timings, frame_timings = bench_game_loop(directory, conn, options.rounds, options.batch_size)
+        write_throughput = bench_database_writes(directory, conn, options.answers, options.write_batch_size)
+        conn.close()
+
+    pygame.quit()
+
+    results = {
+        'benchmark': 'game_loop',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'sdl': '.'.join(str(part) for part in pygame.get_sdl_version()),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'options': vars(options),
+        'states': dict((state, percentiles(timings)) for state, timings in sorted(state_timings.items())),
+        'frames': percentiles(frame_timings),
+        'database_writes': write_throughput,
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares the memory and time it takes to load every phrase into the old
+per-instance __dict__ phrase class, a list of slotted sightright.phrase
+objects, and a column-oriented sightright.phrase_batch.
+
+    python3 benchmarks/bench_phrase_batch.py [--sizes 10000 100000 500000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sightright
+
+class dict_phrase:
+    """
+    The phrase class as it was: class attribute defaults, overridden in
+    each instance's __dict__
+    """
+    phrase_id = ''
+    text = ''
+    origin_list = ''
+    batch_id = ''
+    enabled = False
+
+def load_dict_phrases(cur):
+    phrases = []
+    for row in cur:
+        phrase_obj = dict_phrase()
+        phrase_obj.phrase_id = row[0]
+        phrase_obj.text = row[1]
+        phrase_obj.origin_list = row[2]
+        phrase_obj.batch_id = -1
+        phrase_obj.enabled = row[3] == 1
+        phrases.append(phrase_obj)
+    return phrases
+
+def load_slotted_phrases(cur):
+    return [sightright.phrase(row[0], row[1], row[2], -1, row[3] == 1) for row in cur]
+
+def load_phrase_batch(cur):
+    phrases = sightright.phrase_batch()
+    phrases.extend_from_rows(cur)
+    return phrases
+
+def build_database(path, num_of_phrases):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    sightright.setup_database(cur, conn)
+    rows = (("phrase %d" % i, "benchmark", i % 10 != 0) for i in range(num_of_phrases))
+    cur.executemany('INSERT INTO phrases (phrase, list, enabled) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    return conn
+
+def measure(conn, loader):
+    """
+    Loads every phrase with loader
+    Returns (seconds taken, bytes still allocated afterwards)
+    """
+    cur = conn.cursor()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cur.execute('SELECT phrase_id, phrase, list, enabled FROM phrases ORDER BY phrase_id')
+    phrases = loader(cur)
+    elapsed = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del phrases
+    return (elapsed, allocated)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark phrase representations')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    options = parser.parse_args()
+
+    loaders = [("dict class", load_dict_phrases), ("slotted", load_slotted_phrases), ("phrase_batch", load_phrase_batch)]
+
+    print("%10s  %-14s %10s %12s %14s" % ("phrases", "representation", "time", "memory", "bytes/phrase"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in options.sizes:
+            conn = build_database(os.path.join(directory, "bench_%d.db" % size), size)
+            for name, loader in loaders:
+                elapsed, allocated = measure(conn, loader)
+                print("%10d  %-14s %7.1f ms %9.1f MB %14.0f" % (size, name, elapsed * 1000, allocated / 1000000, allocated / size))
+            conn.close()
+
+if __name__ == '__main__':
+    main()
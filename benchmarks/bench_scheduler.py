@@ -0,0 +1,75 @@
+"""
+Times sightright.schedule_phrase_batch() on libraries from 1,000 to
+1,000,000 phrases, for a learner who has already answered none, a quarter
+and three quarters of each, against finding the phrases the learner has
+never answered with a NOT EXISTS anti-join on phrase_schedule. Nothing is
+overdue, so every round is built from new phrases; the scheduler's time
+should stay flat as the library and the learner's history grow.
+
+    python3 benchmarks/bench_scheduler.py [--phrases 1000 10000 100000 1000000] [--answered 0 0.25 0.75]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sightright
+
+ANTI_JOIN_QUERY = 'SELECT phrase_id, phrase FROM phrases WHERE enabled = 1 AND NOT EXISTS (SELECT 1 FROM phrase_schedule WHERE learner_id = ? AND phrase_schedule.phrase_id = phrases.phrase_id) ORDER BY phrase_id LIMIT ?'
+
+def time_ms(function, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark picking new phrases as the library grows and a learner works through it')
+    parser.add_argument('--phrases', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--answered', type=float, nargs='+', default=[0, 0.25, 0.75], help='Fractions of the library already answered')
+    parser.add_argument('--batch-size', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+
+    # Answered phrases are due a long way off, so none of them is overdue
+    due_time = time.time() + 365 * 24 * 60 * 60
+    print("%10s  %10s  %14s  %14s" % ("phrases", "answered", "scheduler", "anti-join"))
+    for num_of_phrases in options.phrases:
+        with tempfile.TemporaryDirectory() as directory:
+            conn = sightright.connect_database(directory)
+            cur = conn.cursor()
+            sightright.setup_database(cur, conn)
+            # Random sort keys, as an import gives them
+            cur.executemany('INSERT INTO phrases (phrase, list, enabled, sort_key) VALUES (?, ?, 1, ?)',
+                            (("phrase %d" % i, "benchmark", random.randint(1, sightright.PHRASE_SORT_KEY_SPAN)) for i in range(num_of_phrases)))
+            conn.commit()
+
+            answered = 0
+            for fraction in sorted(options.answered):
+                target = int(num_of_phrases * fraction)
+                cur.executemany('INSERT INTO phrase_schedule (learner_id, phrase_id, due_time, ease, repetitions, interval_days) VALUES (?, ?, ?, 2.5, 1, 1.0)',
+                                ((sightright.DEFAULT_LEARNER_ID, phrase_id, due_time) for phrase_id in range(answered + 1, target + 1)))
+                conn.commit()
+                answered = max(answered, target)
+
+                def scheduler():
+                    sightright.schedule_phrase_batch(cur, options.batch_size, time.time())
+
+                def anti_join():
+                    cur.execute(ANTI_JOIN_QUERY, (sightright.DEFAULT_LEARNER_ID, options.batch_size))
+                    cur.fetchall()
+
+                print("%10d  %10d  %11.3f ms  %11.3f ms" % (num_of_phrases, answered, time_ms(scheduler, options.repeat), time_ms(anti_join, options.repeat)))
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Times how long the admin commands take to start and finish, now that pygame
+is only imported when the game starts, against importing it up front the way
+sightright.py used to. Also reports the import time of sightright and
+pygame from python -X importtime.
+
+    python3 benchmarks/bench_startup.py [--repeat 20]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Runs sightright.py the way it used to start, with pygame imported first
+EAGER_PYGAME = "import sys, runpy, pygame; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__')"
+
+def time_ms(command, repeat, directory):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def import_time_ms(module, directory):
+    """
+    Returns the cumulative import time of module in ms, from -X importtime
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark start-up time of the admin commands')
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # sightright.py keeps its database next to itself, so work on a copy
+        script = os.path.join(directory, 'sightright.py')
+        shutil.copy(os.path.join(repository_directory, 'sightright.py'), script)
+        subprocess.run([sys.executable, script, '--import-phrases', os.path.join(repository_directory, 'wordlist.csv')],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        print("Import time (python -X importtime):")
+        for module in ('sightright', 'pygame'):
+            print("  %-12s %8.1f ms" % (module, import_time_ms(module, directory)))
+
+        print("%-18s  %12s  %12s" % ("command", "lazy pygame", "eager pygame"))
+        for arguments in (['--list-phrases'], ['--check-database'], ['--phrase-stats']):
+            lazy = time_ms([sys.executable, script] + arguments, options.repeat, directory)
+            eager = time_ms([sys.executable, '-c', EAGER_PYGAME, script] + arguments, options.repeat, directory)
+            print("%-18s  %9.1f ms  %9.1f ms" % (' '.join(arguments), lazy, eager))
+
+if __name__ == '__main__':
+    main()
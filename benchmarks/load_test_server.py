@@ -0,0 +1,127 @@
+"""
+Load tests sightright.py --serve on localhost: starts a session server on a
+copy of the word list, then has many simulated kiosks play rounds against it
+at once (start a batch, send answers a few at a time, finish the batch), and
+reports request latency percentiles and throughput per endpoint. Checks
+afterwards that every answer sent reached the database.
+
+    python3 benchmarks/load_test_server.py [--clients 48] [--rounds 5]
+"""
+import argparse
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, repository_directory)
+import sightright
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def wait_for_server(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def play(address, rounds, answers_per_request, timings, errors):
+    """
+    One kiosk: plays rounds, recording (endpoint, ms) for every request
+    """
+    client = sightright.session_client(address)
+
+    def timed(endpoint, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append((endpoint, (time.perf_counter() - start) * 1000))
+        if result == None:
+            errors.append(endpoint)
+        return result
+
+    for round_number in range(rounds):
+        phrases = timed('POST /batch', client.get_phrase_batch, sightright.WORDS_PER_BATCH)
+        if phrases == None:
+            continue
+        answers = [(phrases.batch_id, phrase_id, random.randint(300, 6000), random.choice(["Correct", "Incorrect"]), 1.0, 500.0, sightright.DEFAULT_LEARNER_ID)
+                   for phrase_id in phrases.phrase_ids]
+        for i in range(0, len(answers), answers_per_request):
+            timed('POST /responses', client.record_responses, answers[i:i + answers_per_request])
+        timed('POST /batch/finish', client.finish_batch, phrases.batch_id)
+    timed('GET /learners', client.get_learners)
+    client.connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the session server on localhost')
+    parser.add_argument('--clients', type=int, default=48)
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds each client plays')
+    parser.add_argument('--answers-per-request', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # sightright.py keeps its database next to itself, so serve a copy
+        script = os.path.join(directory, 'sightright.py')
+        shutil.copy(os.path.join(repository_directory, 'sightright.py'), script)
+        subprocess.run([sys.executable, script, '--import-phrases', os.path.join(repository_directory, 'wordlist.csv')],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        port = free_port()
+        address = '127.0.0.1:%d' % port
+        server = subprocess.Popen([sys.executable, script, '--serve', address], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_for_server(port, 10):
+                print("Session server did not start")
+                sys.exit(1)
+
+            timings = []
+            errors = []
+            clients = [threading.Thread(target=play, args=(address, options.rounds, options.answers_per_request, timings, errors))
+                       for i in range(options.clients)]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+        conn = sqlite3.connect(os.path.join(directory, 'SightRight.db'))
+        recorded = conn.execute('SELECT count(*) FROM response_history').fetchone()[0]
+        finished = conn.execute('SELECT count(*) FROM batches WHERE end_time IS NOT NULL').fetchone()[0]
+        conn.close()
+
+    print("%d clients x %d rounds in %.2f s: %d requests (%.0f/s), %d failed" %
+          (options.clients, options.rounds, elapsed, len(timings), len(timings) / elapsed, len(errors)))
+    print("%-20s %8s %10s %10s %10s %10s" % ("endpoint", "requests", "p50", "p90", "p99", "max"))
+    for endpoint in sorted(set(endpoint for endpoint, ms in timings)):
+        ordered = sorted(ms for timed_endpoint, ms in timings if timed_endpoint == endpoint)
+        print("%-20s %8d %7.1f ms %7.1f ms %7.1f ms %7.1f ms" % (endpoint, len(ordered), percentile(ordered, 0.5), percentile(ordered, 0.9), percentile(ordered, 0.99), ordered[-1]))
+
+    expected = options.clients * options.rounds * sightright.WORDS_PER_BATCH
+    print("Answers recorded: %d of %d; batches finished: %d of %d" % (recorded, expected, finished, options.clients * options.rounds))
+    if recorded != expected or errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
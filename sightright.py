@@ -1,12 +1,24 @@
-import pygame
 import time
 import sys
 import sqlite3
 import logging
+import logging.handlers
 import os
 import argparse
+import random
+import collections
+import bisect
+import array
+import gzip
+import threading
+import queue
 from time import gmtime, strftime
 
+# pygame takes a while to import, and the admin commands (--list-phrases,
+# --import-phrases and so on) never open a window, so it is only imported
+# once the game is about to start; see load_pygame()
+pygame = None
+
 ################################################################################
 # Constants for game states (not necessarily listed in order)                  #
 ################################################################################
@@ -21,14 +33,146 @@ SKIP_WORD = 60
 #WAIT_FOR_NEW_WORD = 70
 BATCH_END = 80
 
+GAME_STATE_NAMES = {
+    BATCH_START: 'BATCH_START',
+    ACCEPT_INPUT: 'ACCEPT_INPUT',
+    PRESENT_WORD: 'PRESENT_WORD',
+    CORRECT_GUESS: 'CORRECT_GUESS',
+    INCORRECT_GUESS: 'INCORRECT_GUESS',
+    DISPLAY_WAIT: 'DISPLAY_WAIT',
+    SKIP_WORD: 'SKIP_WORD',
+    BATCH_END: 'BATCH_END',
+}
+
+# States that sit waiting for a keypress or timer, as opposed to doing work
+IDLE_GAME_STATES = (BATCH_START, ACCEPT_INPUT, DISPLAY_WAIT, BATCH_END)
+
 # Number of milliseconds to keep a word displayed on the screen after state change
 SPLASH_DELAY = 70
 
+# Font used for the word on screen, and the largest size it is shown at.
+# Phrases too wide for the display at that size are drawn at the largest size
+# that fits (see fit_font_size())
+SIGHT_WORD_FONT_NAME = 'freesansbold.ttf'
+SIGHT_WORD_FONT_SIZE = 115
+
+# --bake-atlas renders every enabled phrase into this file next to the
+# database. It starts with ATLAS_MAGIC and the offset and length of a JSON
+# index, then an 8-bit coverage image of each phrase; see bake_atlas()
+ATLAS_FILE_NAME = "SightRight.atlas"
+ATLAS_MAGIC = b'SRATLAS1'
+ATLAS_HEADER_FORMAT = '<8sQQ'
+
+# Number of rendered phrases to keep around; only the current word in every
+# colour scheme and the next word need to fit
+PHRASE_SURFACE_CACHE_SIZE = 8
+
+# Maximum number of answers waiting to be written to the database. If the
+# writer falls this far behind, the game waits for it rather than drop answers
+RESPONSE_QUEUE_SIZE = 256
+# Seconds the game waits for queued answers to be written at the end of a
+# round or on the way out, before carrying on without them
+RESPONSE_FLUSH_TIMEOUT = 10
+
+# Connection settings applied by connect_database(): bytes of the database
+# file to memory map for reads, seconds to wait for another connection's
+# write lock (the game and its response_writer both write) before giving up,
+# and how many prepared statements each connection keeps for reuse
+DATABASE_MMAP_SIZE = 64 * 1024 * 1024
+DATABASE_BUSY_TIMEOUT = 5.0
+DATABASE_STATEMENT_CACHE_SIZE = 256
+DATABASE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL')
+
+# --serve: the address listened on when none is given, the number of
+# database connections shared by all kiosks, the largest request accepted
+# (phrase imports are the big ones), and seconds before an idle kiosk
+# connection is closed. Kiosks (--connect) give up on a request after
+# SERVER_CLIENT_TIMEOUT seconds
+SERVER_DEFAULT_ADDRESS = '127.0.0.1:8765'
+SERVER_POOL_SIZE = 4
+SERVER_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+SERVER_IDLE_TIMEOUT = 120
+SERVER_CLIENT_TIMEOUT = 30
+# Most phrases a kiosk may ask for in one batch or endless window
+SERVER_MAX_WORDS = 1000
+# Seconds a kiosk keeps retrying, a second apart, to send answers before
+# giving up on them
+SERVER_WRITE_RETRY_SECONDS = 60
+SERVER_STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# Number of CSV rows to hand to SQLite at a time when importing phrases
+IMPORT_CHUNK_SIZE = 500
+
+# Answers moved out of response_history by --archive-before are appended to
+# this gzip'd CSV file, in the archive folder next to the database
+ARCHIVE_FILE_NAME = "response_history.csv.gz"
+ARCHIVE_COLUMNS = ['response_id', 'batch_id', 'phrase_id', 'response_time_ms', 'response_status', 'render_to_flip_ms', 'flip_to_input_ms', 'learner_id', 'batch_start_time']
+
+# Number of words in a round, unless --words says otherwise
+WORDS_PER_BATCH = 30
+
+# --endless: phrases are fetched this many at a time, and the next window is
+# fetched once only ENDLESS_REFILL_AT words of the current one are left
+ENDLESS_WINDOW_SIZE = 10
+ENDLESS_REFILL_AT = 3
+# If the last word of the window has been shown before the next window has
+# arrived, the splash is kept up this many milliseconds longer at a time
+ENDLESS_WAIT_DELAY = 100
+
+# Learner that answers are recorded against unless another is chosen; every
+# database has it, and history from before learners existed belongs to it
+DEFAULT_LEARNER_ID = 1
+
+# Spaced repetition (SM-2). A correct answer within SCHEDULER_FLUENT_MS counts
+# as a perfect recall, a slower one as a hesitant recall. A phrase answered
+# incorrectly comes back after SCHEDULER_RELEARN_DELAY seconds, so it shows up
+# again in the next round rather than the next day
+SCHEDULER_FLUENT_MS = 2000
+SCHEDULER_RELEARN_DELAY = 10 * 60
+SCHEDULER_INITIAL_EASE = 2.5
+SCHEDULER_MINIMUM_EASE = 1.3
+
+# Upper bounds (in ms) of the response time buckets kept for each phrase in
+# phrase_stats; each is 25% wider than the last, so percentiles read from
+# them are within 25% of the true value. Anything slower lands in a last,
+# open-ended bucket
+STATS_HISTOGRAM_BOUNDS_MS = [int(100 * 1.25 ** i) for i in range(28)]
+
+# A phrase needs this many answers before --phrase-stats flags it, and is
+# flagged when its mean answer time is this many standard deviations (of all
+# answers) away from the overall mean
+STATS_MIN_RESPONSES = 3
+STATS_FLAG_DEVIATION = 0.5
+
+# --analytics: answers are read this many rows at a time, batch averages are
+# smoothed over this many batches, a phrase is flagged when its mean answer
+# time is this many standard errors from the overall mean, and an answer is
+# an outlier when it is this many of its phrase's standard deviations away
+# from the phrase's mean
+ANALYTICS_CHUNK_SIZE = 100000
+ANALYTICS_ROLLING_BATCHES = 5
+ANALYTICS_FLAG_Z = 2.0
+ANALYTICS_OUTLIER_STDDEVS = 3.0
+# Number of most recent batches shown in the --analytics trend
+ANALYTICS_REPORT_BATCHES = 10
+
+# Number of recent state transitions, frames and database writes kept in
+# trace_buffer, for dumping to the log if SightRight exits abnormally
+TRACE_BUFFER_SIZE = 256
+
+# Upper bounds (in ms) of the timing buckets kept for each section by
+# --profile, from 10 microseconds up to about 8.5 seconds; each is 25% wider
+# than the last, like STATS_HISTOGRAM_BOUNDS_MS
+PROFILE_HISTOGRAM_BOUNDS_MS = [0.01 * 1.25 ** i for i in range(62)]
+# Percentiles of each section written to the --profile summary
+PROFILE_PERCENTILES = (0.5, 0.95, 0.99)
+
 ################################################################################
 # Error constants                                                              #
 ################################################################################
 
 CANNOT_CONNECT_TO_DATABASE = 1
+CANNOT_MIGRATE_DATABASE = 3
 
 ################################################################################
 # Global settings                                                              #
@@ -42,19 +186,108 @@ red = (255,0,0)
 green = (46,172,102)
 # Force debug mode on all the time?
 debug_on = False
+# Use the old 60 Hz polling game loop instead of waiting for events?
+poll_loop = False
+# Record wall clock and CPU time per game state, reported on exit?
+measure_cpu = False
+# How hard SQLite works to get each commit onto disk; one of
+# DATABASE_SYNCHRONOUS_LEVELS. With the write-ahead log, NORMAL can lose the
+# last few answers to a power cut but never corrupts the database
+database_synchronous = 'NORMAL'
 
 # Get the directory that we're currently running from
 current_directory = os.path.realpath(os.path.dirname(sys.argv[0]))
 
+# Replaced with a fully configured logger by setup_logging()
+logger = logging.getLogger('sightright')
+# Writes queued log records to the console and log file from a background
+# thread; started by setup_logging()
+log_listener = None
+
+# Recent (time, event, details) entries; see trace()
+trace_buffer = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+
+# Pre-rendered backgrounds with the static control labels, keyed by
+# (background_color, text_color); see get_static_overlay()
+static_overlay_cache = {}
+# Colour scheme currently on screen, and the regions drawn over it last frame
+displayed_overlay_key = None
+dirty_rectangles = []
+
+# Background writer for response_history; set up when the game starts
+response_log = None
+# session_client for the session server, when playing with --connect
+server_session = None
+# Background fetcher for the next window of an --endless session
+window_fetcher = None
+
+# Number of words in a round (--words)
+words_per_batch = WORDS_PER_BATCH
+# Keep playing until the player quits (--endless)? phrases then only holds a
+# window of the session, starting at word number window_start, and the batch
+# is finished on the way out
+endless_mode = False
+window_start = 0
+endless_batch_id = None
+
+# (learner_id, name) of every learner, and the index of the one playing;
+# set up when the game starts
+learners = []
+current_learner = 0
+
+# When the last frame reached the screen, and how long it took to draw; set
+# by update_display() and used to time answers from the moment a word appears
+last_flip_time = None
+last_render_ms = 0.0
+# When get_game_events() last handed over events
+last_event_time = None
+
+# Seconds of [wall clock, CPU] time spent in each game state (--measure-cpu),
+# and the (state, wall clock, CPU) readings at the start of the current pass
+cpu_usage = {}
+cpu_measurement = None
+
+# Time each game state, frame and database call (--profile)? Each section's
+# timings are kept in profile_timings as [histogram, count, total ms, max ms];
+# see profile_section(). Sections are only ever timed from one thread, so the
+# writer thread's and game loop's updates never meet
+profiling = False
+profile_timings = {}
+# Milliseconds get_game_events() spent asleep during the current pass, which
+# is left out of the time charged to the game state
+event_wait_ms = 0.0
+# cProfile.Profile running for --cprofile, and the file its stats go to
+cprofile_profiler = None
+cprofile_file_name = None
+
+# Rendered phrase surfaces keyed by (text, background_color, text_color),
+# least recently used first; see render_phrase()
+phrase_surface_cache = collections.OrderedDict()
+# Sight word fonts keyed by point size; see get_sight_word_font()
+sight_word_fonts = {}
+# Point size each phrase is drawn at on this display, keyed by text; filled
+# from the phrase_font_sizes table by load_phrase_font_sizes()
+phrase_font_sizes = {}
+# (memory map, index) of the baked phrase images, if there is a usable
+# atlas; see open_atlas()
+phrase_atlas = None
+# Palettes shading from background to text colour for atlas images, keyed by
+# (background_color, text_color); see get_atlas_surface()
+atlas_palettes = {}
+
 ################################################################################
 # Classes                                                                      #
 ################################################################################
 
 class phrase:
-    phrase_id = ''
-    text = ''
-    batch_id = ''
-    enabled = False
+    __slots__ = ('phrase_id', 'text', 'origin_list', 'batch_id', 'enabled')
+
+    def __init__(self, phrase_id='', text='', origin_list='', batch_id='', enabled=False):
+        self.phrase_id = phrase_id
+        self.text = text
+        self.origin_list = origin_list
+        self.batch_id = batch_id
+        self.enabled = enabled
 
     def __str__(self):
         selfstring =  'id: %s  |  ' % self.phrase_id
@@ -64,16 +297,321 @@ class phrase:
 
         return selfstring
 
+class phrase_batch:
+    """
+    A column-oriented list of phrases: ids and enabled flags in arrays, texts
+    and list names in plain lists. Indexing or iterating hands out phrase
+    objects built on demand, so a large batch costs a few machine words per
+    phrase plus its strings, rather than an object per phrase
+    """
+    __slots__ = ('batch_id', 'phrase_ids', 'texts', 'origin_lists', 'enabled')
+
+    def __init__(self, batch_id=-1):
+        self.batch_id = batch_id
+        self.phrase_ids = array.array('q')
+        self.texts = []
+        self.origin_lists = []
+        self.enabled = array.array('b')
+
+    def append(self, phrase_id, text, origin_list='', enabled=True):
+        self.phrase_ids.append(phrase_id)
+        self.texts.append(text)
+        self.origin_lists.append(origin_list)
+        self.enabled.append(1 if enabled else 0)
+
+    def extend_from_rows(self, rows):
+        """
+        Appends (phrase_id, phrase) rows, all enabled, or (phrase_id, phrase,
+        list, enabled) rows, straight from a cursor
+        """
+        for row in rows:
+            if len(row) == 2:
+                self.append(row[0], row[1])
+            else:
+                self.append(row[0], row[1], row[2], row[3] == 1)
+
+    def __len__(self):
+        return len(self.phrase_ids)
+
+    def __getitem__(self, index):
+        return phrase(self.phrase_ids[index], self.texts[index], self.origin_lists[index], self.batch_id, self.enabled[index] == 1)
+
+    def __iter__(self):
+        for index in range(len(self.phrase_ids)):
+            yield self[index]
+
+class deferred_queue_handler(logging.handlers.QueueHandler):
+    """
+    Queues log records for log_listener without formatting them first, so
+    the message is only built on the listener's thread, off the render path
+    """
+
+    def prepare(self, record):
+        return record
+
+class response_writer:
+    """
+    Writes answers to response_history from a background thread, so the game
+    loop never waits on a commit. Answers are queued with log(); the thread
+    writes whatever has queued up in a single transaction. flush() waits until
+    everything queued so far is committed, close() flushes and stops the thread;
+    both can be given a timeout, and closing tells a write in progress to give up.
+    The constructor waits for the thread to connect; connected is False if it
+    couldn't, and the thread has stopped. A write that fails is rolled back
+    and its answers logged, and the thread carries on with the next one.
+    Subclasses can write somewhere else by overriding connect(), write(),
+    abort() and disconnect(), which are only called on the writer's thread
+    """
+
+    def __init__(self, curr_loc, queue_size=RESPONSE_QUEUE_SIZE):
+        self.curr_loc = curr_loc
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.connected = False
+        self.ready = threading.Event()
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='response_writer', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def log(self, batch_id, phrase_id, time_to_result, result, render_to_flip_ms=None, flip_to_input_ms=None, learner_id=DEFAULT_LEARNER_ID):
+        # Blocks if the queue is full; an answer is never dropped
+        if profiling:
+            queue_start_time = time.perf_counter()
+        self.pending.put(('response', (batch_id, phrase_id, time_to_result, result, render_to_flip_ms, flip_to_input_ms, learner_id)))
+        if profiling:
+            profile_section('database/queue_answer', queue_start_time)
+
+    def flush(self, timeout=None):
+        """
+        Waits for everything queued so far to be written, for up to timeout
+        seconds (forever if None)
+        Returns True if it was all written in time, False if not
+        """
+        flushed = threading.Event()
+        try:
+            self.pending.put(('flush', flushed), timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes what is queued and stops the thread, waiting for up to timeout
+        seconds (forever if None)
+        Returns True if the thread stopped in time, False if not
+        """
+        self.closing.set()
+        try:
+            self.pending.put(('stop', None), timeout=timeout)
+        except queue.Full:
+            return False
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def connect(self):
+        # Returns True once connected
+        self.conn = connect_database(self.curr_loc)
+        if self.conn == None:
+            return False
+        self.cur = self.conn.cursor()
+        return True
+
+    def write(self, responses):
+        record_responses(self.cur, self.conn, responses)
+
+    def abort(self, responses):
+        # Undoes whatever part of a failed write() got done
+        self.conn.rollback()
+
+    def disconnect(self):
+        self.conn.close()
+
+    def run(self):
+        global logger
+
+        try:
+            self.connected = self.connect()
+        except Exception:
+            logger.exception("Response writer could not connect")
+        self.ready.set()
+        if not self.connected:
+            return
+        stopping = False
+
+        while not stopping:
+            # Wait for something to do, then take everything else that is queued
+            items = [self.pending.get()]
+            while True:
+                try:
+                    items.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            responses = []
+            flushed_events = []
+            for kind, payload in items:
+                if kind == 'response':
+                    responses.append(payload)
+                elif kind == 'flush':
+                    flushed_events.append(payload)
+                elif kind == 'stop':
+                    stopping = True
+
+            try:
+                if responses:
+                    write_start_time = time.monotonic()
+                    if profiling:
+                        profile_start_time = time.perf_counter()
+                    self.write(responses)
+                    if profiling:
+                        profile_section('database/write_answers', profile_start_time)
+                    write_ms = (time.monotonic() - write_start_time) * 1000
+                    trace('write', len(responses), write_ms)
+                    logger.debug("Wrote %d responses in %.1f ms; %d still queued", len(responses), write_ms, self.pending.qsize())
+            except Exception:
+                # Keep the thread alive for the answers still to come
+                logger.exception("Could not write %d responses", len(responses))
+                try:
+                    self.abort(responses)
+                except Exception:
+                    logger.exception("Could not roll back the failed write")
+                for response in responses:
+                    logger.error("Could not log results into database: (%s, %s, %s, %s, %s, %s, %s)", *response)
+            finally:
+                # Never leave flush() waiting
+                for flushed in flushed_events:
+                    flushed.set()
+
+        self.disconnect()
+
+class phrase_window_fetcher:
+    """
+    Fetches the next window of an endless session from a background thread,
+    so the game loop never waits on the database between words. request()
+    asks for a window and returns at once, and take() hands it over once it
+    has arrived. The stored font sizes of the window's phrases are looked up
+    along with it, and the sizes the game had to work out for the last
+    window are saved. The constructor waits for the thread to connect;
+    connected is False if it couldn't. Subclasses can fetch from somewhere
+    else by overriding connect(), fetch() and disconnect(), which are only
+    called on the fetcher's thread
+    """
+
+    def __init__(self, curr_loc):
+        self.curr_loc = curr_loc
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = False
+        self.connected = False
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='phrase_window_fetcher', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def request(self, num_of_words, learner_id, exclude):
+        # Only one window is fetched at a time; asking again does nothing
+        if self.pending:
+            return
+        self.pending = True
+        self.requests.put((num_of_words, learner_id, exclude))
+
+    def take(self):
+        """
+        Returns (rows, font sizes) for the window asked for, or None if it
+        hasn't arrived yet. rows is None if the fetch failed
+        """
+        try:
+            result = self.results.get_nowait()
+        except queue.Empty:
+            return None
+        self.pending = False
+        return result
+
+    def close(self):
+        # Doesn't wait; a fetch still in progress is of no use to anyone
+        self.requests.put(None)
+
+    def connect(self):
+        # Returns True once connected
+        self.conn = connect_database(self.curr_loc)
+        if self.conn == None:
+            return False
+        self.cur = self.conn.cursor()
+        return True
+
+    def fetch(self, num_of_words, learner_id, exclude):
+        return get_phrase_window(self.cur, num_of_words, learner_id, exclude)
+
+    def disconnect(self):
+        self.conn.close()
+
+    def run(self):
+        global logger
+
+        try:
+            self.connected = self.connect()
+        except Exception:
+            logger.exception("Phrase window fetcher could not connect")
+        self.ready.set()
+        if not self.connected:
+            return
+
+        key = (SIGHT_WORD_FONT_NAME, SIGHT_WORD_FONT_SIZE, display_width, display_height)
+        # Phrases of the last window that had no stored font size
+        unsized = []
+        while True:
+            item = self.requests.get()
+            if item == None:
+                break
+            num_of_words, learner_id, exclude = item
+
+            rows = None
+            font_sizes = {}
+            fetch_start_time = time.monotonic()
+            if profiling:
+                profile_start_time = time.perf_counter()
+            try:
+                # By now the game has worked out the sizes it needed
+                fitted = [(text,) + key + (phrase_font_sizes[text],) for text in unsized if text in phrase_font_sizes]
+                if fitted:
+                    self.cur.executemany('INSERT OR REPLACE INTO phrase_font_sizes (phrase, font_name, max_font_size, display_width, display_height, font_size) VALUES (?, ?, ?, ?, ?, ?)', fitted)
+                    self.conn.commit()
+                unsized = []
+
+                rows = self.fetch(num_of_words, learner_id, exclude)
+                for phrase_id, text in rows or []:
+                    self.cur.execute(PHRASE_FONT_SIZE_QUERY, (text,) + key)
+                    row = self.cur.fetchone()
+                    if row == None:
+                        unsized.append(text)
+                    else:
+                        font_sizes[text] = row[0]
+            except Exception:
+                logger.exception("Could not fetch the next %d phrases", num_of_words)
+                rows = None
+            if profiling:
+                profile_section('database/fetch_window', profile_start_time)
+            trace('fetch', 0 if rows == None else len(rows), (time.monotonic() - fetch_start_time) * 1000)
+            self.results.put((rows, font_sizes))
+
+        self.disconnect()
+
 ################################################################################
 # Functions                                                                    #
 ################################################################################
 
 def setup_logging():
+    """
+    Sends logs to the console, and to a log file if logging_enabled. Records
+    are handed to a queue and written out by log_listener on its own thread,
+    so the game never waits on the console or the disk
+    """
     global logger
     global current_directory
     global logging_enabled
     global debug_on
     global start_time
+    global log_listener
 
     start_time = gmtime()
 
@@ -90,9 +628,11 @@ def setup_logging():
     console_log_stream_handler.setLevel(logging.INFO)
     if debug_on:
         console_log_stream_handler.setLevel(logging.DEBUG)
-    logger.addHandler(console_log_stream_handler)
+    log_handlers = [console_log_stream_handler]
 
     # Send logs to log files (if specified at runtime)
+    log_file_name = None
+    log_directory_missing = False
     if logging_enabled:
         log_directory = current_directory + os.sep + "logs"
 
@@ -113,17 +653,87 @@ def setup_logging():
             try:
                 os.mkdir(log_directory)
             except:
-                logger.error("Log directory does not exist and could not be created. Exiting...")
-                quit_sightright(2)
-
-        # Send logs to the log file
-        disk_file_handler = logging.FileHandler(filename=log_file_name)
-        disk_file_handler.setFormatter(formatter)
-        disk_file_handler.setLevel(logging.INFO)
-        if debug_on:
-            disk_file_handler.setLevel(logging.DEBUG)
-        logger.addHandler(disk_file_handler)
-        logger.info("Logging enabled. Sending to log file: %s" % log_file_name)
+                log_directory_missing = True
+
+        if not log_directory_missing:
+            # Send logs to the log file
+            disk_file_handler = logging.FileHandler(filename=log_file_name)
+            disk_file_handler.setFormatter(formatter)
+            disk_file_handler.setLevel(logging.INFO)
+            if debug_on:
+                disk_file_handler.setLevel(logging.DEBUG)
+            log_handlers.append(disk_file_handler)
+
+    log_queue = queue.Queue()
+    logger.addHandler(deferred_queue_handler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+    sys.excepthook = report_unhandled_exception
+    threading.excepthook = report_unhandled_thread_exception
+
+    if log_directory_missing:
+        logger.error("Log directory does not exist and could not be created. Exiting...")
+        quit_sightright(2)
+    if log_file_name != None:
+        logger.info("Logging enabled. Sending to log file: %s", log_file_name)
+
+def stop_logging():
+    """
+    Writes out any queued log records and stops log_listener
+    """
+    global log_listener
+
+    if log_listener != None:
+        log_listener.stop()
+        log_listener = None
+
+def trace(event, *details):
+    """
+    Notes an event in trace_buffer. This is cheap enough to leave on all the
+    time: nothing is formatted or written unless dump_trace() is called
+    """
+    trace_buffer.append((time.monotonic(), event, details))
+
+def dump_trace():
+    """
+    Logs the entries in trace_buffer, oldest first, with how long before the
+    dump each one happened
+    """
+    global logger
+
+    if not trace_buffer:
+        return
+    dump_time = time.monotonic()
+    logger.error("Last %d trace entries:", len(trace_buffer))
+    for event_time, event, details in list(trace_buffer):
+        details_text = ' '.join(('%.1f' % detail) if isinstance(detail, float) else str(detail) for detail in details)
+        logger.error("  %9.3f s ago  %-6s %s", dump_time - event_time, event, details_text)
+
+def report_unhandled_exception(exc_type, exc_value, exc_traceback):
+    """
+    sys.excepthook: logs the exception along with the trace leading up to
+    it, then stops logging, as the interpreter is on its way out
+    """
+    global logger
+
+    dump_trace()
+    logger.critical("Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
+    stop_logging()
+
+def report_unhandled_thread_exception(args):
+    """
+    threading.excepthook: logs an exception that ended a background thread
+    (the response_writer, a database_lane) along with the trace leading up
+    to it. The program carries on, so logging is left running
+    """
+    global logger
+
+    if args.exc_type == SystemExit:
+        # Threads may end themselves with sys.exit(), as with the default hook
+        return
+    dump_trace()
+    thread_name = args.thread.name if args.thread != None else None
+    logger.critical("Unhandled exception in thread %s", thread_name, exc_info=(args.exc_type, args.exc_value, args.exc_traceback))
 
 def does_database_exist(curr_loc):
     """
@@ -138,19 +748,892 @@ def does_database_exist(curr_loc):
 
 def setup_database(cur, conn):
     """
-    Set up the tables in the database.
+    Set up the tables in the database, or bring an existing database up to
+    date with the current schema.
+    Returns 1 on success, 0 on failure
     """
-    cmd = "CREATE TABLE phrases (phrase, list, enabled, difficulty);"
-    cur.execute(cmd)
-    cmd = "CREATE TABLE batches (batch_id INT NOT NULL, start_time, end_time);"
-    cur.execute(cmd)
-    cmd = "CREATE TABLE response_history (batch_id INT NOT NULL, phrase_id INT NOT NULL, response_time_ms INT, response_status);"
-    cur.execute(cmd)
-    conn.commit()
+    return migrate_database(cur, conn)
+
+def get_schema_version(cur):
+    """
+    Returns the schema version recorded in the database (PRAGMA user_version)
+    """
+    cur.execute('PRAGMA user_version')
+    return cur.fetchone()[0]
+
+def migrate_database(cur, conn):
+    """
+    Applies every migration in SCHEMA_MIGRATIONS that is newer than the
+    database's user_version. Each migration runs in its own transaction and
+    bumps user_version as part of it, so an interrupted upgrade can be resumed.
+    Returns 1 on success, 0 on failure
+    """
+    global logger
+
+    current_version = get_schema_version(cur)
+    target_version = len(SCHEMA_MIGRATIONS)
+    logger.debug("Database schema version %d, latest is %d", current_version, target_version)
+
+    if current_version > target_version:
+        logger.error("Database schema version %d is newer than this version of SightRight understands (%d)", current_version, target_version)
+        return 0
+
+    for version in range(current_version + 1, target_version + 1):
+        logger.info("Upgrading database schema to version %d", version)
+        try:
+            cur.execute('BEGIN')
+            for cmd in SCHEMA_MIGRATIONS[version - 1]:
+                if callable(cmd):
+                    # Data migrations that are easier to express in Python
+                    logger.debug("Migration step: %s()", cmd.__name__)
+                    cmd(cur)
+                    continue
+                logger.debug("SQLite command: %s", cmd)
+                cur.execute(cmd)
+            cur.execute('PRAGMA user_version = %d' % version)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error("Could not upgrade database schema to version %d: %s", version, e)
+            return 0
+
+    if current_version != target_version:
+        verify_query_plans(cur)
+    return 1
+
+def verify_query_plans(cur):
+    """
+    Runs EXPLAIN QUERY PLAN over the lookups that get hit during play and
+    warns about any that would fall back to a full table scan
+    Returns the number of queries that scan a table
+    """
+    global logger
+
+    scans = 0
+    for description, cmd, params in HOT_QUERIES:
+        cur.execute('EXPLAIN QUERY PLAN ' + cmd, params)
+        plan = [row[-1] for row in cur.fetchall()]
+        logger.debug("Query plan for %s: %s", description, ' / '.join(plan))
+        for step in plan:
+            if step.startswith('SCAN') and 'INDEX' not in step:
+                logger.warning("Query for %s scans a whole table: %s", description, step)
+                scans += 1
+    return scans
+
+def update_phrase_stats(cur, responses):
+    """
+    Folds a list of response tuples (as taken by record_responses()) into
+    phrase_stats: the answer count, correct count, running mean and sum of
+    squared deviations (Welford's method) and a response time histogram for
+    each learner and phrase. Responses without a time are left out.
+    Doesn't commit; the caller owns the transaction
+    """
+    by_phrase = collections.defaultdict(list)
+    for response in responses:
+        if response[2] != None:
+            by_phrase[(response[6], response[1])].append(response)
+
+    for (learner_id, phrase_id), phrase_responses in by_phrase.items():
+        cur.execute('SELECT response_count, correct_count, mean_ms, m2_ms, histogram FROM phrase_stats WHERE learner_id = ? AND phrase_id = ?', (learner_id, phrase_id))
+        row = cur.fetchone()
+        if row == None:
+            count, correct, mean, m2 = 0, 0, 0.0, 0.0
+            histogram = [0] * (len(STATS_HISTOGRAM_BOUNDS_MS) + 1)
+        else:
+            count, correct, mean, m2 = row[0], row[1], row[2], row[3]
+            histogram = [int(bucket) for bucket in row[4].split(',')]
+
+        for response in phrase_responses:
+            time_ms = response[2]
+            count += 1
+            if response[3] == "Correct":
+                correct += 1
+            delta = time_ms - mean
+            mean += delta / count
+            m2 += delta * (time_ms - mean)
+            histogram[bisect.bisect_left(STATS_HISTOGRAM_BOUNDS_MS, time_ms)] += 1
+
+        cur.execute('INSERT OR REPLACE INTO phrase_stats (learner_id, phrase_id, response_count, correct_count, mean_ms, m2_ms, histogram) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (learner_id, phrase_id, count, correct, mean, m2, ','.join(str(bucket) for bucket in histogram)))
+
+def update_phrase_schedule(cur, responses, now):
+    """
+    Moves each answered phrase along the learner's SM-2 schedule for it in
+    phrase_schedule: its ease factor, number of successful reviews in a row,
+    interval in days and the time (in seconds since the epoch) it is next
+    due. Responses are applied in order, all as of now.
+    Doesn't commit; the caller owns the transaction
+    """
+    for response in responses:
+        phrase_id, time_to_result, result, learner_id = response[1], response[2], response[3], response[6]
+        if result == "Correct" and time_to_result != None and time_to_result <= SCHEDULER_FLUENT_MS:
+            quality = 5
+        elif result == "Correct":
+            quality = 3
+        else:
+            quality = 1
+
+        cur.execute('SELECT ease, repetitions, interval_days FROM phrase_schedule WHERE learner_id = ? AND phrase_id = ?', (learner_id, phrase_id))
+        row = cur.fetchone()
+        if row == None:
+            cur.execute('SELECT phrase_id FROM phrases WHERE phrase_id = ?', (phrase_id,))
+            if cur.fetchone() == None:
+                # The phrase has been removed since it was answered
+                continue
+            ease, repetitions, interval_days = SCHEDULER_INITIAL_EASE, 0, 0.0
+        else:
+            ease, repetitions, interval_days = row
+
+        ease = max(SCHEDULER_MINIMUM_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        if quality < 3:
+            repetitions = 0
+            interval_days = 0.0
+            due_time = now + SCHEDULER_RELEARN_DELAY
+        else:
+            repetitions += 1
+            if repetitions == 1:
+                interval_days = 1.0
+            elif repetitions == 2:
+                interval_days = 6.0
+            else:
+                interval_days = interval_days * ease
+            due_time = now + interval_days * 24 * 60 * 60
+
+        cur.execute('INSERT OR REPLACE INTO phrase_schedule (learner_id, phrase_id, due_time, ease, repetitions, interval_days) VALUES (?, ?, ?, ?, ?, ?)',
+                    (learner_id, phrase_id, due_time, ease, repetitions, interval_days))
+
+def phrase_stats_percentile(histogram, fraction, bounds=STATS_HISTOGRAM_BOUNDS_MS):
+    """
+    Returns the response time (in ms) below which roughly fraction of the
+    answers in histogram fall, or None if it is empty. The answer is the
+    upper bound of the bucket it lands in; bounds are the buckets' upper
+    bounds, if not those of phrase_stats
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+    target = fraction * total
+    seen = 0
+    for bucket, bucket_count in enumerate(histogram):
+        seen += bucket_count
+        if seen >= target:
+            break
+    if bucket >= len(bounds):
+        return float('inf')
+    return bounds[bucket]
+
+def get_phrase_stats(cur, learner_id=DEFAULT_LEARNER_ID):
+    """
+    Reads phrase_stats for every phrase the learner has answered
+    Returns a list of (phrase_id, phrase, response_count, correct_count,
+    mean_ms, m2_ms, histogram) tuples, histogram being a list of bucket counts
+    """
+    cur.execute('SELECT phrase_stats.phrase_id, phrase, response_count, correct_count, mean_ms, m2_ms, histogram FROM phrase_stats JOIN phrases ON phrases.phrase_id = phrase_stats.phrase_id WHERE learner_id = ? ORDER BY phrase', (learner_id,))
+    return [row[:6] + ([int(bucket) for bucket in row[6].split(',')],) for row in cur.fetchall()]
+
+def report_phrase_stats(cur, learner_id=DEFAULT_LEARNER_ID):
+    """
+    Prints count, accuracy and answer time statistics for each phrase the
+    learner has answered, and flags the ones answered noticeably faster or
+    slower than average. Reads only phrase_stats, so it costs one row per
+    phrase however long the history is
+    """
+    stats = get_phrase_stats(cur, learner_id)
+    if not stats:
+        print("No answers recorded yet")
+        return
+
+    # Combine the per-phrase means and deviations into overall figures
+    total_count = 0
+    total_mean = 0.0
+    total_m2 = 0.0
+    for phrase_id, text, count, correct, mean, m2, histogram in stats:
+        if count == 0:
+            continue
+        delta = mean - total_mean
+        combined_count = total_count + count
+        total_mean += delta * count / combined_count
+        total_m2 += m2 + delta * delta * total_count * count / combined_count
+        total_count = combined_count
+    total_stddev = (total_m2 / total_count) ** 0.5
+
+    print("Overall: %d answers, mean %.0f ms, standard deviation %.0f ms" % (total_count, total_mean, total_stddev))
+    print("%6s  %-24s %7s %8s %9s %9s %9s %9s" % ('id', 'phrase', 'answers', 'correct', 'mean', 'stddev', 'median', '90th'))
+    for phrase_id, text, count, correct, mean, m2, histogram in stats:
+        stddev = (m2 / count) ** 0.5
+        flag = ''
+        if count >= STATS_MIN_RESPONSES:
+            if mean > total_mean + STATS_FLAG_DEVIATION * total_stddev:
+                flag = 'above average'
+            elif mean < total_mean - STATS_FLAG_DEVIATION * total_stddev:
+                flag = 'below average'
+        print("%6s  %-24s %7d %7.0f%% %6.0f ms %6.0f ms %6.0f ms %6.0f ms  %s" % (phrase_id, text, count, correct / count * 100, mean, stddev,
+              phrase_stats_percentile(histogram, 0.5), phrase_stats_percentile(histogram, 0.9), flag))
+
+def load_response_columns(cur, learner_id=DEFAULT_LEARNER_ID, chunk_size=ANALYTICS_CHUNK_SIZE, archive_file_name=None):
+    """
+    Reads the learner's timed answers, archived (see iter_archived_columns())
+    and live, into NumPy arrays, chunk_size rows at a time
+    Returns a dictionary of equal length arrays: phrase_id and batch_id
+    (int32), time_ms (float32) and correct (bool)
+    """
+    import numpy
+
+    if archive_file_name == None:
+        archive_file_name = get_archive_file_name(current_directory)
+
+    column_parts = {'phrase_id': [], 'batch_id': [], 'time_ms': [], 'correct': []}
+
+    def add_columns(phrase_id, batch_id, time_ms, correct):
+        column_parts['phrase_id'].append(phrase_id)
+        column_parts['batch_id'].append(batch_id)
+        column_parts['time_ms'].append(time_ms)
+        column_parts['correct'].append(correct)
+
+    def add_chunk(rows):
+        chunk = numpy.array(rows, dtype=numpy.float64).reshape(-1, 4)
+        add_columns(chunk[:, 0].astype(numpy.int32), chunk[:, 1].astype(numpy.int32), chunk[:, 2].astype(numpy.float32), chunk[:, 3] > 0)
+
+    for archived_columns in iter_archived_columns(archive_file_name, learner_id, chunk_size):
+        add_columns(*archived_columns)
+
+    # +learner_id keeps SQLite off the (learner_id, phrase_id) index: reading
+    # the whole table in order is quicker than a lookup per answer
+    cur.execute("SELECT phrase_id, batch_id, response_time_ms, response_status = 'Correct' FROM response_history WHERE +learner_id = ? AND response_time_ms IS NOT NULL", (learner_id,))
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        add_chunk(rows)
+
+    columns = {}
+    for name, dtype in (('phrase_id', numpy.int32), ('batch_id', numpy.int32), ('time_ms', numpy.float32), ('correct', numpy.bool_)):
+        columns[name] = numpy.concatenate(column_parts[name]) if column_parts[name] else numpy.empty(0, dtype=dtype)
+    return columns
+
+def analyse_responses(columns):
+    """
+    Computes per-phrase and per-batch statistics from load_response_columns()
+    output, with grouped NumPy operations rather than a loop over answers.
+    Each phrase gets a z-score: how many standard errors its mean answer time
+    is from the mean of all answers
+    Returns a dictionary of arrays: for phrases (slowest z-score first),
+    phrase_id, count, correct, mean_ms, stddev_ms, z and outliers; for
+    batches (in order), batch_id, batch_count, batch_mean_ms and
+    batch_rolling_mean_ms; and the overall mean_ms and stddev_ms
+    """
+    import numpy
+
+    time_ms = columns['time_ms'].astype(numpy.float64)
+    phrase_ids, phrase_index = numpy.unique(columns['phrase_id'], return_inverse=True)
+    counts = numpy.bincount(phrase_index)
+    sums = numpy.bincount(phrase_index, weights=time_ms)
+    squares = numpy.bincount(phrase_index, weights=time_ms * time_ms)
+    correct = numpy.bincount(phrase_index, weights=columns['correct'])
+
+    means = sums / counts
+    stddevs = numpy.sqrt(numpy.maximum(squares / counts - means * means, 0))
+    overall_mean = time_ms.mean()
+    overall_stddev = time_ms.std()
+    if overall_stddev > 0:
+        z = (means - overall_mean) / (overall_stddev / numpy.sqrt(counts))
+    else:
+        z = numpy.zeros(len(phrase_ids))
+
+    # Answers well away from their own phrase's usual time
+    deviations = numpy.abs(time_ms - means[phrase_index])
+    answer_stddevs = stddevs[phrase_index]
+    is_outlier = (answer_stddevs > 0) & (deviations > ANALYTICS_OUTLIER_STDDEVS * answer_stddevs)
+    outliers = numpy.bincount(phrase_index, weights=is_outlier, minlength=len(phrase_ids))
+
+    batch_ids, batch_index = numpy.unique(columns['batch_id'], return_inverse=True)
+    batch_counts = numpy.bincount(batch_index)
+    batch_means = numpy.bincount(batch_index, weights=time_ms) / batch_counts
+    # Mean of each batch and up to ANALYTICS_ROLLING_BATCHES - 1 before it
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(batch_means)))
+    ends = numpy.arange(1, len(batch_means) + 1)
+    starts = numpy.maximum(ends - ANALYTICS_ROLLING_BATCHES, 0)
+    rolling_means = (cumulative[ends] - cumulative[starts]) / (ends - starts)
+
+    order = numpy.argsort(-z, kind='stable')
+    return {
+        'phrase_id': phrase_ids[order],
+        'count': counts[order],
+        'correct': correct[order],
+        'mean_ms': means[order],
+        'stddev_ms': stddevs[order],
+        'z': z[order],
+        'outliers': outliers[order],
+        'batch_id': batch_ids,
+        'batch_count': batch_counts,
+        'batch_mean_ms': batch_means,
+        'batch_rolling_mean_ms': rolling_means,
+        'overall_mean_ms': overall_mean,
+        'overall_stddev_ms': overall_stddev,
+    }
+
+def report_analytics(cur, learner_id=DEFAULT_LEARNER_ID):
+    """
+    Prints every phrase the learner has answered, slowest first by z-score,
+    flagging those well above or below average, followed by the average
+    answer time of recent batches
+    Returns 1 on success, None if NumPy isn't available
+    """
+    global logger
+
+    try:
+        import numpy
+    except ImportError:
+        logger.error("--analytics needs NumPy; install it with: pip3 install numpy")
+        return None
+
+    columns = load_response_columns(cur, learner_id)
+    if len(columns['time_ms']) == 0:
+        print("No answers recorded yet")
+        return 1
+    results = analyse_responses(columns)
+
+    cur.execute('SELECT phrase_id, phrase FROM phrases')
+    texts = dict(cur.fetchall())
+
+    print("Overall: %d answers, mean %.0f ms, standard deviation %.0f ms" % (len(columns['time_ms']), results['overall_mean_ms'], results['overall_stddev_ms']))
+    print("%5s %6s  %-24s %7s %8s %9s %9s %7s %8s" % ('rank', 'id', 'phrase', 'answers', 'correct', 'mean', 'stddev', 'z', 'outliers'))
+    for rank in range(len(results['phrase_id'])):
+        z = results['z'][rank]
+        flag = ''
+        if z > ANALYTICS_FLAG_Z:
+            flag = 'above average'
+        elif z < -ANALYTICS_FLAG_Z:
+            flag = 'below average'
+        phrase_id = int(results['phrase_id'][rank])
+        count = int(results['count'][rank])
+        print("%5d %6d  %-24s %7d %7.0f%% %6.0f ms %6.0f ms %7.2f %8d  %s" % (rank + 1, phrase_id, texts.get(phrase_id, '(removed)'), count,
+              results['correct'][rank] / count * 100, results['mean_ms'][rank], results['stddev_ms'][rank], z, results['outliers'][rank], flag))
+
+    print("")
+    print("Recent batches (rolling mean over %d batches):" % ANALYTICS_ROLLING_BATCHES)
+    print("%8s %7s %9s %9s" % ('batch', 'answers', 'mean', 'rolling'))
+    for index in range(max(len(results['batch_id']) - ANALYTICS_REPORT_BATCHES, 0), len(results['batch_id'])):
+        print("%8d %7d %6.0f ms %6.0f ms" % (results['batch_id'][index], results['batch_count'][index], results['batch_mean_ms'][index], results['batch_rolling_mean_ms'][index]))
+    return 1
+
+def get_learners(cur):
+    """
+    Returns a list of (learner_id, name) tuples, in the order they were added
+    """
+    cur.execute('SELECT learner_id, name FROM learners ORDER BY learner_id')
+    return cur.fetchall()
+
+def get_learner_id(cur, name):
+    """
+    Returns the learner_id of the learner called name, or None if there is
+    no such learner
+    """
+    cur.execute('SELECT learner_id FROM learners WHERE name = ?', (name,))
+    row = cur.fetchone()
+    if row == None:
+        return None
+    return row[0]
+
+def add_learner(cur, conn, name):
+    """
+    Adds a learner profile
+    Returns the new learner_id, or None if the learner already exists
+    """
+    global logger
+
+    try:
+        cur.execute('INSERT INTO learners (name) VALUES (?)', (name,))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        logger.error("There is already a learner called '%s'", name)
+        return None
+    return cur.lastrowid
+
+################################################################################
+# Database schema                                                              #
+################################################################################
+
+def migrate_phrase_stats_v5(cur):
+    """
+    Schema version 5: fills phrase_stats from the answers recorded so far.
+    Reads response_history as it was at version 5 and keeps its own copy of
+    the histogram bounds, so later changes to either can't change what this
+    migration does
+    """
+    global logger
+
+    bounds = [int(100 * 1.25 ** i) for i in range(28)]
+    stats = {}
+    history = cur.connection.cursor()
+    history.execute('SELECT phrase_id, response_time_ms, response_status FROM response_history WHERE response_time_ms IS NOT NULL ORDER BY response_id')
+    for phrase_id, time_ms, status in history:
+        phrase = stats.get(phrase_id)
+        if phrase == None:
+            phrase = stats[phrase_id] = [0, 0, 0.0, 0.0, [0] * (len(bounds) + 1)]
+        phrase[0] += 1
+        if status == "Correct":
+            phrase[1] += 1
+        delta = time_ms - phrase[2]
+        phrase[2] += delta / phrase[0]
+        phrase[3] += delta * (time_ms - phrase[2])
+        phrase[4][bisect.bisect_left(bounds, time_ms)] += 1
+
+    cur.executemany('INSERT INTO phrase_stats (phrase_id, response_count, correct_count, mean_ms, m2_ms, histogram) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((phrase_id, count, correct, mean, m2, ','.join(str(bucket) for bucket in histogram))
+                     for phrase_id, (count, correct, mean, m2, histogram) in stats.items()))
+    logger.info("Built phrase statistics for %d phrases from past answers", len(stats))
+
+# Each entry upgrades the schema by one version; entry N brings user_version
+# from N to N+1. Never edit a migration that has shipped, add a new one.
+# Migrations only use their own SQL and helpers (like
+# migrate_phrase_stats_v5()), never the game's functions, which follow the
+# latest schema rather than the one the migration starts from.
+SCHEMA_MIGRATIONS = [
+    # Version 1: the original tables. Databases created before versioning
+    # already have these, hence IF NOT EXISTS
+    [
+        "CREATE TABLE IF NOT EXISTS phrases (phrase, list, enabled, difficulty)",
+        "CREATE TABLE IF NOT EXISTS batches (batch_id INT NOT NULL, start_time, end_time)",
+        "CREATE TABLE IF NOT EXISTS response_history (batch_id INT NOT NULL, phrase_id INT NOT NULL, response_time_ms INT, response_status)",
+    ],
+    # Version 2: primary keys, typed columns, unique phrases and history indexes.
+    # phrase_id keeps the old rowid, so existing response_history rows still
+    # match; duplicate phrases are merged into the first copy, and answers
+    # recorded against the others are moved onto it
+    [
+        "DROP INDEX IF EXISTS phrases_phrase_unique",
+        "CREATE TEMP TABLE phrase_id_map (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)",
+        "INSERT INTO phrase_id_map (old_id, new_id) SELECT phrases.rowid, kept.phrase_id FROM phrases JOIN (SELECT phrase, min(rowid) AS phrase_id FROM phrases WHERE phrase IS NOT NULL GROUP BY phrase) AS kept ON kept.phrase = phrases.phrase",
+        "CREATE TABLE phrases_v2 (phrase_id INTEGER PRIMARY KEY, phrase TEXT NOT NULL UNIQUE, list TEXT, enabled INTEGER NOT NULL DEFAULT 1, difficulty INTEGER)",
+        "INSERT INTO phrases_v2 (phrase_id, phrase, list, enabled, difficulty) SELECT rowid, phrase, list, CASE WHEN enabled = 'True' THEN 1 ELSE 0 END, difficulty FROM phrases WHERE rowid IN (SELECT min(rowid) FROM phrases WHERE phrase IS NOT NULL GROUP BY phrase)",
+        "DROP TABLE phrases",
+        "ALTER TABLE phrases_v2 RENAME TO phrases",
+        "CREATE TABLE batches_v2 (batch_id INTEGER PRIMARY KEY, start_time TEXT, end_time TEXT)",
+        "INSERT OR IGNORE INTO batches_v2 (batch_id, start_time, end_time) SELECT batch_id, start_time, end_time FROM batches",
+        "DROP TABLE batches",
+        "ALTER TABLE batches_v2 RENAME TO batches",
+        "CREATE TABLE response_history_v2 (response_id INTEGER PRIMARY KEY, batch_id INTEGER NOT NULL, phrase_id INTEGER NOT NULL, response_time_ms INTEGER, response_status TEXT)",
+        "INSERT INTO response_history_v2 (batch_id, phrase_id, response_time_ms, response_status) SELECT batch_id, coalesce(phrase_id_map.new_id, response_history.phrase_id), response_time_ms, response_status FROM response_history LEFT JOIN phrase_id_map ON phrase_id_map.old_id = response_history.phrase_id ORDER BY response_history.rowid",
+        "DROP TABLE phrase_id_map",
+        "DROP TABLE response_history",
+        "ALTER TABLE response_history_v2 RENAME TO response_history",
+        "CREATE INDEX response_history_phrase_id ON response_history (phrase_id)",
+        "CREATE INDEX response_history_batch_id ON response_history (batch_id)",
+    ],
+    # Version 3: index enabled phrases by id so batches can be sampled
+    # without sorting the whole table
+    [
+        "CREATE INDEX phrases_enabled ON phrases (enabled, phrase_id)",
+    ],
+    # Version 4: split answer latency into the time taken to draw the word
+    # and the time from the word reaching the screen to the keypress
+    [
+        "ALTER TABLE response_history ADD COLUMN render_to_flip_ms REAL",
+        "ALTER TABLE response_history ADD COLUMN flip_to_input_ms REAL",
+    ],
+    # Version 5: running answer statistics per phrase, kept up to date as
+    # answers are recorded (see update_phrase_stats())
+    [
+        "CREATE TABLE phrase_stats (phrase_id INTEGER PRIMARY KEY, response_count INTEGER NOT NULL, correct_count INTEGER NOT NULL, mean_ms REAL NOT NULL, m2_ms REAL NOT NULL, histogram TEXT NOT NULL)",
+        migrate_phrase_stats_v5,
+    ],
+    # Version 6: SM-2 scheduling state for each phrase, and an index to find
+    # the most overdue enabled phrases. Phrases never answered have no
+    # due_time and are treated as new
+    [
+        "ALTER TABLE phrases ADD COLUMN due_time REAL",
+        "ALTER TABLE phrases ADD COLUMN ease REAL",
+        "ALTER TABLE phrases ADD COLUMN repetitions INTEGER",
+        "ALTER TABLE phrases ADD COLUMN interval_days REAL",
+        "CREATE INDEX phrases_due ON phrases (enabled, due_time)",
+    ],
+    # Version 7: learner profiles. Batches and answers record who played,
+    # and statistics and schedules are kept per learner. Everything so far
+    # belongs to the Default learner. The scheduling columns on phrases are
+    # superseded by phrase_schedule and no longer used
+    [
+        "CREATE TABLE learners (learner_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+        "INSERT INTO learners (learner_id, name) VALUES (%d, 'Default')" % DEFAULT_LEARNER_ID,
+        "ALTER TABLE batches ADD COLUMN learner_id INTEGER NOT NULL DEFAULT %d" % DEFAULT_LEARNER_ID,
+        "ALTER TABLE response_history ADD COLUMN learner_id INTEGER NOT NULL DEFAULT %d" % DEFAULT_LEARNER_ID,
+        "CREATE INDEX batches_learner_id ON batches (learner_id, batch_id)",
+        "CREATE INDEX response_history_learner_phrase ON response_history (learner_id, phrase_id)",
+        "CREATE TABLE phrase_stats_v7 (learner_id INTEGER NOT NULL, phrase_id INTEGER NOT NULL, response_count INTEGER NOT NULL, correct_count INTEGER NOT NULL, mean_ms REAL NOT NULL, m2_ms REAL NOT NULL, histogram TEXT NOT NULL, PRIMARY KEY (learner_id, phrase_id))",
+        "INSERT INTO phrase_stats_v7 (learner_id, phrase_id, response_count, correct_count, mean_ms, m2_ms, histogram) SELECT %d, phrase_id, response_count, correct_count, mean_ms, m2_ms, histogram FROM phrase_stats" % DEFAULT_LEARNER_ID,
+        "DROP TABLE phrase_stats",
+        "ALTER TABLE phrase_stats_v7 RENAME TO phrase_stats",
+        "CREATE TABLE phrase_schedule (learner_id INTEGER NOT NULL, phrase_id INTEGER NOT NULL, due_time REAL NOT NULL, ease REAL NOT NULL, repetitions INTEGER NOT NULL, interval_days REAL NOT NULL, PRIMARY KEY (learner_id, phrase_id))",
+        "INSERT INTO phrase_schedule (learner_id, phrase_id, due_time, ease, repetitions, interval_days) SELECT %d, phrase_id, due_time, ease, repetitions, interval_days FROM phrases WHERE due_time IS NOT NULL" % DEFAULT_LEARNER_ID,
+        "CREATE INDEX phrase_schedule_due ON phrase_schedule (learner_id, due_time)",
+        "DROP INDEX phrases_due",
+    ],
+    # Version 8: the largest font size each phrase fits the display at, so it
+    # is only worked out once per phrase, font and resolution
+    [
+        "CREATE TABLE phrase_font_sizes (phrase TEXT NOT NULL, font_name TEXT NOT NULL, max_font_size INTEGER NOT NULL, display_width INTEGER NOT NULL, display_height INTEGER NOT NULL, font_size INTEGER NOT NULL, PRIMARY KEY (phrase, font_name, max_font_size, display_width, display_height))",
+    ],
+    # Version 9: the phrases each learner has never been scheduled, each with
+    # a random sort_key, so a round's new phrases are a range read of the
+    # (learner_id, sort_key) index however much the learner has answered, and
+    # every learner meets the library in their own order. Triggers keep it
+    # in step as phrases, learners and schedules come and go
+    [
+        "CREATE TABLE new_phrases (learner_id INTEGER NOT NULL, phrase_id INTEGER NOT NULL, sort_key INTEGER NOT NULL, PRIMARY KEY (learner_id, phrase_id)) WITHOUT ROWID",
+        "INSERT INTO new_phrases (learner_id, phrase_id, sort_key) SELECT learner_id, phrase_id, random() FROM learners, phrases WHERE NOT EXISTS (SELECT 1 FROM phrase_schedule WHERE phrase_schedule.learner_id = learners.learner_id AND phrase_schedule.phrase_id = phrases.phrase_id)",
+        "CREATE INDEX new_phrases_order ON new_phrases (learner_id, sort_key)",
+        "CREATE TRIGGER new_phrases_phrase_added AFTER INSERT ON phrases BEGIN INSERT INTO new_phrases (learner_id, phrase_id, sort_key) SELECT learner_id, NEW.phrase_id, random() FROM learners; END",
+        # One primary key lookup per learner, rather than a scan for the phrase
+        "CREATE TRIGGER new_phrases_phrase_removed AFTER DELETE ON phrases BEGIN DELETE FROM new_phrases WHERE learner_id IN (SELECT learner_id FROM learners) AND phrase_id = OLD.phrase_id; END",
+        "CREATE TRIGGER new_phrases_learner_added AFTER INSERT ON learners BEGIN INSERT INTO new_phrases (learner_id, phrase_id, sort_key) SELECT NEW.learner_id, phrase_id, random() FROM phrases; END",
+        "CREATE TRIGGER new_phrases_phrase_scheduled AFTER INSERT ON phrase_schedule BEGIN DELETE FROM new_phrases WHERE learner_id = NEW.learner_id AND phrase_id = NEW.phrase_id; END",
+    ],
+    # Version 10: new_phrases held a row for every learner and phrase, which
+    # grows to gigabytes with hundreds of learners. Instead each phrase gets
+    # one random sort_key, learners meet new phrases in that order, and
+    # learners.new_phrase_position marks how far along it each learner has
+    # got (see schedule_phrase_batch()). Phrases added or enabled again are
+    # put after every phrase already there, so no learner has passed them
+    [
+        "DROP TRIGGER new_phrases_phrase_added",
+        "DROP TRIGGER new_phrases_phrase_removed",
+        "DROP TRIGGER new_phrases_learner_added",
+        "DROP TRIGGER new_phrases_phrase_scheduled",
+        "DROP TABLE new_phrases",
+        "ALTER TABLE phrases ADD COLUMN sort_key INTEGER",
+        "UPDATE phrases SET sort_key = 1 + abs(random() % 4294967296)",
+        "CREATE INDEX phrases_sort_key ON phrases (sort_key)",
+        "ALTER TABLE learners ADD COLUMN new_phrase_position INTEGER NOT NULL DEFAULT 0",
+        "CREATE TRIGGER phrases_sort_key_added AFTER INSERT ON phrases WHEN NEW.sort_key IS NULL BEGIN UPDATE phrases SET sort_key = (SELECT coalesce(max(sort_key), 0) + 1 FROM phrases) WHERE phrase_id = NEW.phrase_id; END",
+        "CREATE TRIGGER phrases_sort_key_enabled AFTER UPDATE OF enabled ON phrases WHEN NEW.enabled = 1 AND OLD.enabled = 0 BEGIN UPDATE phrases SET sort_key = (SELECT max(sort_key) + 1 FROM phrases) WHERE phrase_id = NEW.phrase_id; END",
+    ],
+]
+
+# Phrases imported together get random sort_keys spread over this many
+# values above the highest one so far, so they are met in a random order
+# but after every phrase already in the library
+PHRASE_SORT_KEY_SPAN = 1 << 32
+
+# Queries used by schedule_phrase_batch(), with (learner_id, [now,] limit)
+# unless noted
+OVERDUE_PHRASES_QUERY = 'SELECT phrases.phrase_id, phrase FROM phrase_schedule JOIN phrases ON phrases.phrase_id = phrase_schedule.phrase_id WHERE learner_id = ? AND phrase_schedule.due_time <= ? AND enabled = 1 ORDER BY phrase_schedule.due_time LIMIT ?'
+# NEW_PHRASES_QUERY takes (new_phrase_position, learner_id, limit). The +
+# keeps SQLite off the phrases_enabled index, which would mean sorting every
+# enabled phrase rather than reading the sort_key index in order
+NEW_PHRASES_QUERY = 'SELECT phrase_id, phrase, sort_key FROM phrases WHERE sort_key > ? AND +enabled = 1 AND NOT EXISTS (SELECT 1 FROM phrase_schedule WHERE learner_id = ? AND phrase_schedule.phrase_id = phrases.phrase_id) ORDER BY sort_key LIMIT ?'
+# Query used by load_phrase_font_sizes(), with (phrase, font_name,
+# max_font_size, display_width, display_height)
+PHRASE_FONT_SIZE_QUERY = 'SELECT font_size FROM phrase_font_sizes WHERE phrase = ? AND font_name = ? AND max_font_size = ? AND display_width = ? AND display_height = ?'
+PHRASES_DUE_NEXT_QUERY = 'SELECT phrases.phrase_id, phrase FROM phrase_schedule JOIN phrases ON phrases.phrase_id = phrase_schedule.phrase_id WHERE learner_id = ? AND phrase_schedule.due_time > ? AND enabled = 1 ORDER BY phrase_schedule.due_time LIMIT ?'
+
+# Lookups that must be served by an index; checked by verify_query_plans()
+HOT_QUERIES = [
+    ("phrase by text", "SELECT phrase_id FROM phrases WHERE phrase = ?", ("a",)),
+    ("phrase by id", "SELECT phrase FROM phrases WHERE phrase_id = ?", (1,)),
+    ("latest batch", "SELECT max(batch_id) FROM batches", ()),
+    ("overdue phrases", OVERDUE_PHRASES_QUERY, (1, 0, 30)),
+    ("new phrases", NEW_PHRASES_QUERY, (0, 1, 30)),
+    ("highest sort key", "SELECT max(sort_key) FROM phrases", ()),
+    ("phrases due next", PHRASES_DUE_NEXT_QUERY, (1, 0, 30)),
+    ("enabled phrases for the atlas", "SELECT phrase FROM phrases WHERE enabled = 1 ORDER BY phrase_id", ()),
+    ("phrase font size", PHRASE_FONT_SIZE_QUERY, ("a", SIGHT_WORD_FONT_NAME, SIGHT_WORD_FONT_SIZE, 480, 272)),
+    ("learner's history of a phrase", "SELECT response_time_ms FROM response_history WHERE learner_id = ? AND phrase_id = ?", (1, 1)),
+    ("learner's statistics", "SELECT phrase_id, mean_ms FROM phrase_stats WHERE learner_id = ?", (1,)),
+    ("learner's batches", "SELECT batch_id FROM batches WHERE learner_id = ?", (1,)),
+    ("history by phrase", "SELECT response_time_ms FROM response_history WHERE phrase_id = ?", (1,)),
+    ("history by batch", "SELECT response_time_ms FROM response_history WHERE batch_id = ?", (1,)),
+]
+
+def get_static_overlay(background_color, text_color):
+    """
+    Returns a full-screen surface filled with background_color and carrying
+    the control labels that never change ("Esc: Quit" and the arrow keys).
+    Built once per colour scheme and kept in static_overlay_cache
+    """
+    global logger
+    global game_display
+    global static_overlay_cache
+
+    overlay_key = (background_color, text_color)
+    if overlay_key in static_overlay_cache:
+        return static_overlay_cache[overlay_key]
+
+    logger.debug("Rendering static overlay for colour scheme %s on %s", text_color, background_color)
+    overlay = pygame.Surface(game_display.get_size())
+    overlay = overlay.convert()
+    overlay.fill(background_color)
+
+    quit_control_text = "Esc: Quit"
+    quit_control_surface = controls_font.render(quit_control_text, True, text_color)
+    quit_control_rectangle = quit_control_surface.get_rect()
+    quit_control_rectangle.topleft = (0, 0)
+    overlay.blit(quit_control_surface, quit_control_rectangle)
+
+    lower_right_controls_text_3 = 'Right: Skip word'
+    lower_right_controls_text_2 = 'Down: Incorrect'
+    lower_right_controls_text_1 = 'Up: Correct'
+
+    lower_right_controls_text_3_surface = controls_font.render(lower_right_controls_text_3, True, text_color)
+    lower_right_controls_text_3_rectangle = lower_right_controls_text_3_surface.get_rect()
+    lower_right_controls_text_3_rectangle.bottomright = ((display_width), (display_height))
+    overlay.blit(lower_right_controls_text_3_surface, lower_right_controls_text_3_rectangle)
+
+    lower_right_controls_text_2_surface = controls_font.render(lower_right_controls_text_2, True, text_color)
+    lower_right_controls_text_2_rectangle = lower_right_controls_text_2_surface.get_rect()
+    lower_right_controls_text_2_rectangle.bottomleft = lower_right_controls_text_3_rectangle.topleft
+    overlay.blit(lower_right_controls_text_2_surface, lower_right_controls_text_2_rectangle)
+
+    lower_right_controls_text_1_surface = controls_font.render(lower_right_controls_text_1, True, text_color)
+    lower_right_controls_text_1_rectangle = lower_right_controls_text_1_surface.get_rect()
+    lower_right_controls_text_1_rectangle.bottomleft = lower_right_controls_text_2_rectangle.topleft
+    overlay.blit(lower_right_controls_text_1_surface, lower_right_controls_text_1_rectangle)
+
+    static_overlay_cache[overlay_key] = overlay
+    return overlay
+
+def get_sight_word_font(size):
+    """
+    Returns SIGHT_WORD_FONT_NAME at size points, loading it the first time
+    """
+    global sight_word_fonts
+
+    font = sight_word_fonts.get(size)
+    if font == None:
+        font = pygame.font.Font(SIGHT_WORD_FONT_NAME, size)
+        sight_word_fonts[size] = font
+    return font
+
+def fit_font_size(word):
+    """
+    Binary searches the font sizes up to SIGHT_WORD_FONT_SIZE for the largest
+    one word fits across the display at. Only measures the text, it doesn't
+    render it
+    Returns the font size
+    """
+    global logger
+
+    if get_sight_word_font(SIGHT_WORD_FONT_SIZE).size(word)[0] <= display_width:
+        return SIGHT_WORD_FONT_SIZE
+
+    # Invariant: low fits (or is the smallest size), high doesn't fit
+    low = 1
+    high = SIGHT_WORD_FONT_SIZE
+    while high - low > 1:
+        middle = (low + high) // 2
+        if get_sight_word_font(middle).size(word)[0] <= display_width:
+            low = middle
+        else:
+            high = middle
+    logger.debug("Phrase '%s' is too wide at %d points; using %d points", word, SIGHT_WORD_FONT_SIZE, low)
+    return low
+
+def load_phrase_font_sizes(cur, conn, texts):
+    """
+    Makes sure phrase_font_sizes has an entry for each of texts: looked up in
+    the phrase_font_sizes table for the current font and display, or worked
+    out with fit_font_size() and saved there for next time
+    Returns the number of phrases whose size had to be worked out
+    """
+    global logger
+    global phrase_font_sizes
+
+    key = (SIGHT_WORD_FONT_NAME, SIGHT_WORD_FONT_SIZE, display_width, display_height)
+    fitted = []
+    for text in texts:
+        if text in phrase_font_sizes:
+            continue
+        cur.execute(PHRASE_FONT_SIZE_QUERY, (text,) + key)
+        row = cur.fetchone()
+        if row == None:
+            phrase_font_sizes[text] = fit_font_size(text)
+            fitted.append((text,) + key + (phrase_font_sizes[text],))
+        else:
+            phrase_font_sizes[text] = row[0]
+
+    if fitted:
+        logger.debug("Saving font sizes for %d phrases", len(fitted))
+        cur.executemany('INSERT OR REPLACE INTO phrase_font_sizes (phrase, font_name, max_font_size, display_width, display_height, font_size) VALUES (?, ?, ?, ?, ?, ?)', fitted)
+        conn.commit()
+    return len(fitted)
+
+def get_atlas_file_name(curr_loc):
+    return curr_loc + os.sep + ATLAS_FILE_NAME
+
+def atlas_key():
+    """
+    Returns what the atlas images depend on besides the phrase and colour, as
+    stored in the atlas index
+    """
+    return [SIGHT_WORD_FONT_NAME, SIGHT_WORD_FONT_SIZE, display_width, display_height, pygame.version.ver]
+
+def bake_atlas(cur, conn, atlas_file_name):
+    """
+    Renders every enabled phrase, at its phrase_font_sizes size, into a
+    single atlas file. Each phrase is stored once, as the 8-bit coverage of
+    its antialiased text, which get_atlas_surface() turns into any colour
+    scheme with a palette. The file is written under a temporary name
+    and moved into place, so a running game never sees half of it
+    Returns the number of phrases baked
+    """
+    global logger
+
+    import json
+    import struct
+
+    load_pygame()
+    pygame.font.init()
+
+    cur.execute('SELECT phrase FROM phrases WHERE enabled = 1 ORDER BY phrase_id')
+    texts = [row[0] for row in cur.fetchall()]
+    load_phrase_font_sizes(cur, conn, texts)
+
+    index = {'key': atlas_key(), 'phrases': {}}
+    temporary_file_name = atlas_file_name + '.tmp'
+    with open(temporary_file_name, 'wb') as atlas_file:
+        atlas_file.write(struct.pack(ATLAS_HEADER_FORMAT, ATLAS_MAGIC, 0, 0))
+        for text in texts:
+            # The alpha channel of white text is how much of each pixel it covers
+            surface = get_sight_word_font(phrase_font_sizes[text]).render(text, True, white)
+            coverage = pygame.image.tostring(surface, 'RGBA')[3::4]
+            index['phrases'][text] = [phrase_font_sizes[text], atlas_file.tell(), surface.get_width(), surface.get_height()]
+            atlas_file.write(coverage)
+
+        index_offset = atlas_file.tell()
+        index_data = json.dumps(index).encode('utf-8')
+        atlas_file.write(index_data)
+        atlas_file.seek(0)
+        atlas_file.write(struct.pack(ATLAS_HEADER_FORMAT, ATLAS_MAGIC, index_offset, len(index_data)))
+        # On disk before it replaces the old atlas, so a power cut can't
+        # leave an empty or partial one behind
+        atlas_file.flush()
+        os.fsync(atlas_file.fileno())
+    os.replace(temporary_file_name, atlas_file_name)
+
+    logger.info("Baked %d phrases into %s (%d KB)", len(texts), atlas_file_name, os.path.getsize(atlas_file_name) // 1024)
+    return len(texts)
+
+def open_atlas(atlas_file_name):
+    """
+    Memory maps the atlas file and reads its index. The images themselves
+    are only paged in when they are first drawn
+    Returns (memory map, index), or None if there is no atlas, it is
+    damaged, or it was baked for a different font, display or pygame version
+    """
+    global logger
+
+    import json
+    import mmap
+    import struct
+
+    if not os.path.exists(atlas_file_name):
+        logger.debug("No phrase atlas at %s; rendering phrases as needed", atlas_file_name)
+        return None
+
+    try:
+        with open(atlas_file_name, 'rb') as atlas_file:
+            # An empty file can't be mapped, and raises ValueError
+            atlas_map = mmap.mmap(atlas_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not open phrase atlas %s (%s); rendering phrases as needed", atlas_file_name, e)
+        return None
+
+    try:
+        header_size = struct.calcsize(ATLAS_HEADER_FORMAT)
+        magic, index_offset, index_length = struct.unpack(ATLAS_HEADER_FORMAT, atlas_map[:header_size])
+        if magic != ATLAS_MAGIC:
+            logger.warning("%s is not a phrase atlas; ignoring it", atlas_file_name)
+            atlas_map.close()
+            return None
+
+        index = json.loads(atlas_map[index_offset:index_offset + index_length].decode('utf-8'))
+        if index['key'] != atlas_key():
+            logger.warning("Phrase atlas was baked for a different font, display or pygame version; run --bake-atlas again")
+            atlas_map.close()
+            return None
+        # Every image must lie between the header and the index
+        for font_size, offset, width, height in index['phrases'].values():
+            if offset < header_size or offset + width * height > index_offset:
+                raise ValueError("image out of bounds")
+    except (ValueError, struct.error, KeyError, TypeError) as e:
+        # JSON and UTF-8 errors are ValueErrors too
+        logger.warning("Phrase atlas %s is damaged (%s); rendering phrases as needed. Run --bake-atlas again", atlas_file_name, e)
+        atlas_map.close()
+        return None
+
+    logger.debug("Using phrase atlas %s with %d phrases", atlas_file_name, len(index['phrases']))
+    return (atlas_map, index['phrases'])
+
+def get_atlas_surface(word, background_color, text_color, font_size):
+    """
+    Returns an 8-bit surface drawing straight from the atlas memory map,
+    with a palette shading from background_color to text_color, or None if
+    there is no atlas, the phrase wasn't baked, or it was baked at another
+    size
+    """
+    global phrase_atlas
+    global atlas_palettes
+
+    if phrase_atlas == None:
+        return None
+    atlas_map, atlas_phrases = phrase_atlas
+    image = atlas_phrases.get(word)
+    if image == None or image[0] != font_size:
+        return None
+    baked_font_size, offset, width, height = image
+    palette = atlas_palettes.get((background_color, text_color))
+    if palette == None:
+        palette = [tuple(background_color[channel] + (text_color[channel] - background_color[channel]) * level // 255 for channel in range(3)) for level in range(256)]
+        atlas_palettes[(background_color, text_color)] = palette
+    surface = pygame.image.frombuffer(memoryview(atlas_map)[offset:offset + width * height], (width, height), 'P')
+    surface.set_palette(palette)
+    return surface
+
+def render_phrase(word, background_color, text_color):
+    """
+    Returns a surface with word rendered at the largest size that fits the
+    display (from phrase_font_sizes, or fit_font_size() for a phrase not
+    loaded ahead of time), so it is never scaled. The text is drawn solid on
+    background_color, so it is blitted without blending. The image is taken
+    from the phrase atlas when it has an up to date one, and rendered
+    otherwise. Results are kept in phrase_surface_cache so the game can
+    render the next word ahead of time and present it with a blit
+    """
+    global phrase_surface_cache
+    global phrase_font_sizes
+
+    cache_key = (word, background_color, text_color)
+    if cache_key in phrase_surface_cache:
+        phrase_surface_cache.move_to_end(cache_key)
+        return phrase_surface_cache[cache_key]
+
+    if profiling:
+        render_start_time = time.perf_counter()
+    font_size = phrase_font_sizes.get(word)
+    if font_size == None:
+        font_size = fit_font_size(word)
+        phrase_font_sizes[word] = font_size
+    main_word_surface = get_atlas_surface(word, background_color, text_color, font_size)
+    if main_word_surface == None:
+        main_word_surface = get_sight_word_font(font_size).render(word, True, text_color, background_color)
+    if profiling:
+        profile_section('display/render_phrase', render_start_time)
+
+    phrase_surface_cache[cache_key] = main_word_surface
+    if len(phrase_surface_cache) > PHRASE_SURFACE_CACHE_SIZE:
+        phrase_surface_cache.popitem(last=False)
+    return main_word_surface
 
 def update_display():
+    """
+    Draws the screen for the current game_state. The static labels come from
+    a cached overlay; when the colour scheme is unchanged from the last frame
+    only the regions holding the word, score and messages are redrawn and
+    pushed with pygame.display.update(), otherwise the whole frame is flipped.
+    Records when the frame was flipped in last_flip_time, and how long it took
+    from entering update_display() in last_render_ms
+    """
     global logger
-    global sight_word_font
     global display_width
     global display_height
     global game_display
@@ -161,30 +1644,42 @@ def update_display():
     global words_attempted
     global background_color
     global text_color
+    global displayed_overlay_key
+    global dirty_rectangles
+    global last_flip_time
+    global last_render_ms
+
+    render_start_time = time.monotonic()
+    if profiling:
+        profile_start_time = time.perf_counter()
 
-    background = pygame.Surface(game_display.get_size())
-    background = background.convert()
+    # Surfaces that change from frame to frame, drawn over the static overlay
+    dynamic_surfaces = []
 
     if game_state == BATCH_START:
         background_color = white
         text_color = black
         word = ""
 
-        background.fill(background_color)
-
         press_key_to_begin_text = "Press any key to begin"
         press_key_to_begin_surface = controls_font.render(press_key_to_begin_text, True, text_color)
         press_key_to_begin_rectangle = press_key_to_begin_surface.get_rect()
         press_key_to_begin_rectangle.center = (int(display_width/2), int(display_height/2))
-        background.blit(press_key_to_begin_surface, press_key_to_begin_rectangle)
+        dynamic_surfaces.append((press_key_to_begin_surface, press_key_to_begin_rectangle))
+
+        learner_text = "Learner: %s" % learners[current_learner][1]
+        if len(learners) > 1:
+            learner_text += "  (Left/Right to change)"
+        learner_surface = controls_font.render(learner_text, True, text_color)
+        learner_rectangle = learner_surface.get_rect()
+        learner_rectangle.center = (int(display_width/2), int(display_height*3/4))
+        dynamic_surfaces.append((learner_surface, learner_rectangle))
 
     elif game_state == PRESENT_WORD:
         background_color = white
         text_color = black
         word = current_phrase.text
 
-        background.fill(background_color)
-
     elif game_state == CORRECT_GUESS:
         background_color = green
         text_color = white
@@ -192,12 +1687,10 @@ def update_display():
 
         answer_delay_text = "Answer time: %d ms" % answer_delay_ms
 
-        background.fill(background_color)
-
         answer_delay_surface = controls_font.render(answer_delay_text, True, text_color)
         answer_delay_rectangle = answer_delay_surface.get_rect()
         answer_delay_rectangle.center = (display_width/2, int(display_height*3/4))
-        background.blit(answer_delay_surface, answer_delay_rectangle)
+        dynamic_surfaces.append((answer_delay_surface, answer_delay_rectangle))
 
     elif game_state == INCORRECT_GUESS:
         background_color = black
@@ -206,31 +1699,25 @@ def update_display():
 
         answer_delay_text = "Answer time: %d ms" % answer_delay_ms
 
-        background.fill(background_color)
-
         answer_delay_surface = controls_font.render(answer_delay_text, True, text_color)
         answer_delay_rectangle = answer_delay_surface.get_rect()
         answer_delay_rectangle.center = (display_width/2, int(display_height*3/4))
-        background.blit(answer_delay_surface, answer_delay_rectangle)
+        dynamic_surfaces.append((answer_delay_surface, answer_delay_rectangle))
     elif game_state == SKIP_WORD:
         background_color = white
         text_color = black
         word = ""
 
-        background.fill(background_color)
-
     elif game_state == BATCH_END:
         background_color = white
         text_color = black
         word = ""
 
-        background.fill(background_color)
-
         press_key_to_end_text = "Round complete. Press Q or Esc to quit"
         press_key_to_end_surface = controls_font.render(press_key_to_end_text, True, text_color)
         press_key_to_end_rectangle = press_key_to_end_surface.get_rect()
         press_key_to_end_rectangle.center = (int(display_width/2), int(display_height/2))
-        background.blit(press_key_to_end_surface, press_key_to_end_rectangle)
+        dynamic_surfaces.append((press_key_to_end_surface, press_key_to_end_rectangle))
 
     #elif game_state == WAIT_FOR_NEW_WORD:
         ## Don't change colors, reuse from before
@@ -253,303 +1740,848 @@ def update_display():
         #continue_control_rectangle.midbottom = (display_width/2, display_height)
         #background.blit(continue_control_surface, continue_control_rectangle)
 
-    quit_control_text = "Esc: Quit"
-    quit_control_surface = controls_font.render(quit_control_text, True, text_color)
-    quit_control_rectangle = quit_control_surface.get_rect()
-    quit_control_rectangle.topleft = (0, 0)
-    background.blit(quit_control_surface, quit_control_rectangle)
-
     score_control_text = "Score: %d (%d%%)" % (score, int((score/max(words_attempted, 1))*100))
     score_control_surface = controls_font.render(score_control_text, True, text_color)
     score_control_rectangle = score_control_surface.get_rect()
     score_control_rectangle.topright = (display_width, 0)
-    background.blit(score_control_surface, score_control_rectangle)
+    dynamic_surfaces.append((score_control_surface, score_control_rectangle))
 
-    progress_control_text = "Word: %d of %d" % (current_phrase_number, total_words)
+    if endless_mode:
+        progress_control_text = "Word: %d" % current_phrase_number
+    else:
+        progress_control_text = "Word: %d of %d" % (current_phrase_number, total_words)
     progress_control_surface = controls_font.render(progress_control_text, True, text_color)
     progress_control_rectangle = progress_control_surface.get_rect()
     progress_control_rectangle.bottomleft = (0, display_height)
-    background.blit(progress_control_surface, progress_control_rectangle)
+    dynamic_surfaces.append((progress_control_surface, progress_control_rectangle))
 
-    lower_right_controls_text_3 = 'Right: Skip word'
-    lower_right_controls_text_2 = 'Down: Incorrect'
-    lower_right_controls_text_1 = 'Up: Correct'
+    if word:
+        main_word_surface = render_phrase(word, background_color, text_color)
+        main_word_rectangle = main_word_surface.get_rect()
+        main_word_rectangle.center = ((display_width/2), (display_height/2))
+        dynamic_surfaces.append((main_word_surface, main_word_rectangle))
 
-    lower_right_controls_text_3_surface = controls_font.render(lower_right_controls_text_3, True, text_color)
-    lower_right_controls_text_3_rectangle = lower_right_controls_text_3_surface.get_rect()
-    lower_right_controls_text_3_rectangle.bottomright = ((display_width), (display_height))
-    background.blit(lower_right_controls_text_3_surface, lower_right_controls_text_3_rectangle)
+    overlay_key = (background_color, text_color)
+    overlay = get_static_overlay(background_color, text_color)
+    full_redraw = overlay_key != displayed_overlay_key
 
-    lower_right_controls_text_2_surface = controls_font.render(lower_right_controls_text_2, True, text_color)
-    lower_right_controls_text_2_rectangle = lower_right_controls_text_2_surface.get_rect()
-    lower_right_controls_text_2_rectangle.bottomleft = lower_right_controls_text_3_rectangle.topleft
-    background.blit(lower_right_controls_text_2_surface, lower_right_controls_text_2_rectangle)
+    if full_redraw:
+        logger.debug("Blitting static overlay to screen")
+        game_display.blit(overlay, (0,0))
+    else:
+        # Paint the overlay back over whatever changed in the last frame
+        for rectangle in dirty_rectangles:
+            game_display.blit(overlay, rectangle, rectangle)
+
+    new_dirty_rectangles = []
+    for surface, rectangle in dynamic_surfaces:
+        game_display.blit(surface, rectangle)
+        new_dirty_rectangles.append(rectangle)
+
+    if profiling:
+        profile_section('display/render', profile_start_time)
+        flip_start_time = time.perf_counter()
+    if full_redraw:
+        logger.debug("Updating display")
+        pygame.display.flip()
+    else:
+        logger.debug("Updating %d display regions", len(dirty_rectangles) + len(new_dirty_rectangles))
+        pygame.display.update(dirty_rectangles + new_dirty_rectangles)
+    if profiling:
+        profile_section('display/flip', flip_start_time)
 
-    lower_right_controls_text_1_surface = controls_font.render(lower_right_controls_text_1, True, text_color)
-    lower_right_controls_text_1_rectangle = lower_right_controls_text_1_surface.get_rect()
-    lower_right_controls_text_1_rectangle.bottomleft = lower_right_controls_text_2_rectangle.topleft
-    background.blit(lower_right_controls_text_1_surface, lower_right_controls_text_1_rectangle)
-
-    main_word_surface = sight_word_font.render(word, True, text_color)
-    main_word_rectangle = main_word_surface.get_rect()
-    if main_word_rectangle.width > display_width:
-        logger.debug("Scaling down phrase '%s'; too wide to fit naturally" % word)
-        scale_factor = display_width / main_word_rectangle.width
-        logger.debug("Using scaling factor of %s" % scale_factor)
-        main_word_surface = pygame.transform.smoothscale(main_word_surface, (display_width, int(main_word_rectangle.height * scale_factor)))
-        main_word_rectangle = main_word_surface.get_rect()
-    main_word_rectangle.center = ((display_width/2), (display_height/2))
-    background.blit(main_word_surface, main_word_rectangle)
-
-    # controls_surface = controls_font.render("Down = Incorrect, Up = Correct, Right = Skip, Esc = Quit", True, text_color)
-    # logger.debug("Getting text rectangle for controls")
-    # controls_rectangle = controls_surface.get_rect()
-    # logger.debug("Centering text rectangle for controls in display horizontally")
-    # controls_rectangle.center = ((display_width/2), (display_height - controls_rectangle.height))
-    # logger.debug("Blitting text controls to background")
-    # background.blit(controls_surface, controls_rectangle)
-
-    logger.debug("Blitting background to screen")
-    game_display.blit(background, (0,0))
-    logger.debug("Updating display")
-    pygame.display.flip()
+    last_flip_time = time.monotonic()
+    last_render_ms = (last_flip_time - render_start_time) * 1000
+    trace('frame', GAME_STATE_NAMES[game_state], last_render_ms)
+
+    displayed_overlay_key = overlay_key
+    dirty_rectangles = new_dirty_rectangles
     return
 
 def connect_database(curr_loc):
     """
-    Connects to the SQLite DB
-    Returns the connection
+    Connects to the SQLite DB, in write-ahead log mode (readers and the
+    response_writer don't block each other) with database_synchronous,
+    DATABASE_MMAP_SIZE and DATABASE_BUSY_TIMEOUT. Each connection caches up
+    to DATABASE_STATEMENT_CACHE_SIZE prepared statements, so queries with ?
+    parameters are only compiled once
+    Returns the connection, or None on failure
     """
-    conn = sqlite3.connect(curr_loc + os.sep + "SightRight.db")
+    global logger
+
+    try:
+        conn = sqlite3.connect(curr_loc + os.sep + "SightRight.db", timeout=DATABASE_BUSY_TIMEOUT, cached_statements=DATABASE_STATEMENT_CACHE_SIZE)
+        cur = conn.cursor()
+        cur.execute('PRAGMA journal_mode = WAL')
+        cur.execute('PRAGMA synchronous = %s' % database_synchronous)
+        cur.execute('PRAGMA mmap_size = %d' % DATABASE_MMAP_SIZE)
+        cur.close()
+    except sqlite3.Error as e:
+        logger.error("Could not open the database: %s", e)
+        return None
     return conn
 
-def log_phrase_result(cur, conn, batch_id, phrase_id, time_to_result, result):
+def log_phrase_result(cur, conn, batch_id, phrase_id, time_to_result, result, render_to_flip_ms=None, flip_to_input_ms=None, learner_id=DEFAULT_LEARNER_ID):
+    return record_responses(cur, conn, [(batch_id, phrase_id, time_to_result, result, render_to_flip_ms, flip_to_input_ms, learner_id)])
+
+def record_responses(cur, conn, responses):
+    """
+    Inserts a list of (batch_id, phrase_id, time_to_result, result,
+    render_to_flip_ms, flip_to_input_ms, learner_id) tuples into
+    response_history, and updates the learners' phrase_stats and schedules to
+    match, in a single transaction. render_to_flip_ms and flip_to_input_ms
+    may be None when they weren't measured
+    Returns 1 on success, None on failure
+    """
     global logger
 
     try:
-        cmd = 'INSERT INTO response_history (batch_id, phrase_id, response_time_ms, response_status) VALUES (%s, %s, %s, "%s")' % (batch_id, phrase_id, time_to_result, result)
-        cur.execute(cmd)
+        cmd = 'INSERT INTO response_history (batch_id, phrase_id, response_time_ms, response_status, render_to_flip_ms, flip_to_input_ms, learner_id) VALUES (?, ?, ?, ?, ?, ?, ?)'
+        cur.executemany(cmd, responses)
+        update_phrase_stats(cur, responses)
+        update_phrase_schedule(cur, responses, time.time())
         conn.commit()
-    except sqlite3.OperationalError:
-        logger.error("Could not log results into database: (%s, %s, %s, %s)" % (batch_id, phrase_id, time_to_result, result))
+        return 1
+    except sqlite3.Error:
+        conn.rollback()
+        for response in responses:
+            logger.error("Could not log results into database: (%s, %s, %s, %s, %s, %s, %s)", *response)
         return None
 
-def get_phrase_batch(cur, conn, num_of_words):
+def get_phrase_batch(cur, conn, num_of_words, learner_id=DEFAULT_LEARNER_ID):
     global logger
 
     logger.debug("Entering get_phrase_batch() routine")
 
     try:
         cmd = 'SELECT max(batch_id) FROM batches'
-        logger.debug("SQLite command: %s" % cmd)
+        logger.debug("SQLite command: %s", cmd)
         cur.execute(cmd)
         conn.commit()
 
         batch_id = cur.fetchall()[0][0]
-        logger.debug("Batch ID returned: %s" % batch_id)
+        logger.debug("Batch ID returned: %s", batch_id)
         batch_id += 1
     except:
         logger.warning("There are no current batches")
         batch_id = 1
 
     try:
-        logger.debug("Inserting new batch; batch_id: %s" % batch_id)
-        cmd = 'INSERT INTO batches (batch_id) VALUES (%s)' % batch_id
-        logger.debug("SQLite command: %s" % cmd)
-        cur.execute(cmd)
+        logger.debug("Inserting new batch; batch_id: %s, learner_id: %s", batch_id, learner_id)
+        cmd = 'INSERT INTO batches (batch_id, learner_id, start_time) VALUES (?, ?, ?)'
+        logger.debug("SQLite command: %s", cmd)
+        cur.execute(cmd, (batch_id, learner_id, strftime('%Y-%m-%d %H:%M:%S', gmtime())))
         conn.commit()
     except:
-        logger.error("Could not add batch %s to database" % batch_id)
+        logger.error("Could not add batch %s to database", batch_id)
         return None
 
     try:
-        cmd = 'SELECT rowid,phrase FROM phrases WHERE enabled="True" ORDER BY RANDOM() LIMIT %s' % num_of_words
-        logger.debug("SQLite command: %s" % cmd)
-        cur.execute(cmd)
-        conn.commit()
+        logger.debug("Scheduling %s enabled phrases", num_of_words)
+        sampled_phrases = schedule_phrase_batch(cur, num_of_words, time.time(), learner_id)
 
-        logger.debug("About to iterate through the returned phrases from the database")
-        phrases = []
-        for returned_phrase in cur.fetchall():
-            logger.debug("Working with a row")
-            phrase_obj = phrase()
-
-            phrase_obj.phrase_id = returned_phrase[0]
-            phrase_obj.text = returned_phrase[1]
-            phrase_obj.batch_id = batch_id
-            enabled = True # All phrases returned should be enabled, as defined by the SQL query
-
-            phrases.append(phrase_obj)
+        # All phrases returned are enabled, as defined by the SQL query
+        phrases = phrase_batch(batch_id)
+        phrases.extend_from_rows(sampled_phrases)
         logger.debug("Returning from get_phrase_batch() routine (explicit return)")
         return phrases
     except:
         logger.error("Something bad happened") # This is what happens when you write code at midnight
     logger.debug("Returning from get_phrase_batch() routine (implicit return)")
 
-def get_all_phrases(cur, conn):
-    global logger
+def finish_batch(cur, conn, batch_id):
+    """
+    Records the time a batch was finished
+    """
+    cur.execute('UPDATE batches SET end_time = ? WHERE batch_id = ?', (strftime('%Y-%m-%d %H:%M:%S', gmtime()), batch_id))
+    conn.commit()
 
-    logger.debug("Entering get_all_phrases() routine")
-    logger.debug("Arbitrarily setting batch_id to -1")
-    batch_id = -1
-
-    #try:
-    cmd = 'SELECT rowid,phrase,enabled FROM phrases ORDER BY phrase'
-    logger.debug("SQLite command: %s" % cmd)
-    logger.debug("Executing command")
-    cur.execute(cmd)
-    logger.debug("Committing to database")
+def reschedule_phrase_batch(cur, conn, phrases, num_of_words, learner_id):
+    """
+    Hands a batch that hasn't been started yet over to another learner, and
+    picks that learner's phrases for it
+    Returns the new phrase_batch, with the same batch_id
+    """
+    global logger
+
+    logger.debug("Moving batch %s to learner_id %s", phrases.batch_id, learner_id)
+    cur.execute('UPDATE batches SET learner_id = ? WHERE batch_id = ?', (learner_id, phrases.batch_id))
     conn.commit()
 
-    logger.debug("About to iterate through the returned phrases from the database")
-    logger.debug("Initializing phrases[]")
-    phrases = []
-    logger.debug("Initializing loop")
-    for returned_phrase in cur.fetchall():
-        logger.debug("Working with a row" % str(returned_phrase))
-        phrase_obj = phrase()
-
-        phrase_obj.phrase_id = returned_phrase[0]
-        phrase_obj.text = returned_phrase[1]
-        phrase_obj.batch_id = batch_id
-        if returned_phrase[2] == "True":
-            phrase_obj.enabled = True
-        else:
-            phrase_obj.enabled = False
+    rescheduled = phrase_batch(phrases.batch_id)
+    rescheduled.extend_from_rows(schedule_phrase_batch(cur, num_of_words, time.time(), learner_id))
+    return rescheduled
 
-        phrases.append(phrase_obj)
+def schedule_phrase_batch(cur, num_of_words, now, learner_id=DEFAULT_LEARNER_ID):
+    """
+    Picks up to num_of_words enabled phrases for a round: the ones most
+    overdue for the learner first, then phrases the learner has never
+    answered (in sort_key order), then the ones due soonest. Overdue and due
+    phrases are range reads of the (learner_id, due_time) index, new phrases
+    of the sort_key index, starting from the learner's new_phrase_position.
+    Every phrase before the first new one found has been answered (or is
+    disabled), so the position is moved up to it, and later rounds don't
+    step over the learner's history again. The batch is shuffled, so
+    overdue phrases aren't always asked first
+    Returns a list of (phrase_id, phrase) tuples
+    """
+    global logger
+
+    chosen = []
+    cur.execute(OVERDUE_PHRASES_QUERY, (learner_id, now, num_of_words))
+    chosen.extend(cur.fetchall())
+    overdue = len(chosen)
+
+    if len(chosen) < num_of_words:
+        cur.execute('SELECT new_phrase_position FROM learners WHERE learner_id = ?', (learner_id,))
+        row = cur.fetchone()
+        position = 0 if row == None else row[0]
+        # Phrases added from now on go after this, so none can be passed over
+        cur.execute('SELECT coalesce(max(sort_key), 0) FROM phrases')
+        highest_sort_key = cur.fetchone()[0]
+        cur.execute(NEW_PHRASES_QUERY, (position, learner_id, num_of_words - len(chosen)))
+        rows = cur.fetchall()
+        chosen.extend((phrase_id, phrase) for phrase_id, phrase, sort_key in rows)
+        new_position = rows[0][2] - 1 if rows else highest_sort_key
+        if new_position > position:
+            cur.execute('UPDATE learners SET new_phrase_position = max(new_phrase_position, ?) WHERE learner_id = ?', (new_position, learner_id))
+            cur.connection.commit()
+    new = len(chosen) - overdue
+
+    if len(chosen) < num_of_words:
+        cur.execute(PHRASES_DUE_NEXT_QUERY, (learner_id, now, num_of_words - len(chosen)))
+        chosen.extend(cur.fetchall())
+
+    logger.debug("Scheduled %d overdue, %d new and %d early phrases", overdue, new, len(chosen) - overdue - new)
+    random.shuffle(chosen)
+    return chosen
+
+def get_phrase_window(cur, num_of_words, learner_id, exclude):
+    """
+    Picks the next num_of_words phrases of an endless session the way
+    schedule_phrase_batch() does, skipping the phrase ids in exclude (those
+    still in the session's window) unless there is nothing else to ask
+    Returns a list of (phrase_id, phrase) tuples
+    """
+    rows = schedule_phrase_batch(cur, num_of_words + len(exclude), time.time(), learner_id)
+    fresh = [row for row in rows if row[0] not in exclude]
+    return (fresh or rows)[:num_of_words]
+
+def get_all_phrases(cur, conn):
+    global logger
+
+    logger.debug("Entering get_all_phrases() routine")
+    cur.execute('SELECT phrase_id, phrase, list, enabled FROM phrases ORDER BY phrase')
+    phrases = phrase_batch()
+    phrases.extend_from_rows(cur)
     logger.debug("Returning from get_all_phrases() routine (explicit return)")
     return phrases
-    #except:
-    #    logger.error("Something bad happened") # This is what happens when you write code at midnight
-    logger.debug("Returning from get_all_phrases() routine (implicit return)")
+
+def parse_id_ranges(id_text):
+    """
+    Parses a list of phrase ids and inclusive ranges such as "3,7,10-20"
+    Returns a list of (lowest, highest) tuples; raises ValueError if id_text
+    isn't in that form
+    """
+    id_ranges = []
+    for part in id_text.split(','):
+        part = part.strip()
+        if '-' in part:
+            lowest, highest = part.split('-', 1)
+            id_ranges.append((int(lowest), int(highest)))
+        else:
+            id_ranges.append((int(part), int(part)))
+    return id_ranges
+
+def phrase_filter(list_name=None, enabled=None, min_id=None, max_id=None, id_ranges=None, pattern=None):
+    """
+    Builds a WHERE clause selecting phrases by list name, enabled state (1 or
+    0), an inclusive phrase_id range, a list of (lowest, highest) id ranges
+    (see parse_id_ranges()) and a GLOB pattern on the phrase text. Filters
+    left as None don't apply
+    Returns a tuple of (where clause, parameters); the clause is empty when
+    there is nothing to filter on
+    """
+    conditions = []
+    params = []
+    if id_ranges:
+        id_conditions = []
+        for lowest, highest in id_ranges:
+            if lowest == highest:
+                id_conditions.append('phrase_id = ?')
+                params.append(lowest)
+            else:
+                id_conditions.append('phrase_id BETWEEN ? AND ?')
+                params.extend((lowest, highest))
+        conditions.append('(' + ' OR '.join(id_conditions) + ')')
+    if pattern != None:
+        conditions.append('phrase GLOB ?')
+        params.append(pattern)
+    if list_name != None:
+        conditions.append('list = ?')
+        params.append(list_name)
+    if enabled != None:
+        conditions.append('enabled = ?')
+        params.append(enabled)
+    if min_id != None:
+        conditions.append('phrase_id >= ?')
+        params.append(min_id)
+    if max_id != None:
+        conditions.append('phrase_id <= ?')
+        params.append(max_id)
+
+    if not conditions:
+        return ('', params)
+    return (' WHERE ' + ' AND '.join(conditions), params)
+
+def iter_phrases(cur, list_name=None, enabled=None, min_id=None, max_id=None, id_ranges=None, pattern=None):
+    """
+    Yields a phrase object for each phrase matching the filters (see
+    phrase_filter()), in alphabetical order. Rows are read from the cursor as
+    they are needed, and the ordering comes from the unique index on phrase,
+    so memory use doesn't grow with the size of the library
+    """
+    global logger
+
+    where, params = phrase_filter(list_name, enabled, min_id, max_id, id_ranges, pattern)
+    cmd = 'SELECT phrase_id, phrase, list, enabled FROM phrases' + where + ' ORDER BY phrase'
+    logger.debug("SQLite command: %s", cmd)
+    cur.execute(cmd, params)
+
+    for returned_phrase in cur:
+        # Not part of a batch, hence batch_id -1
+        yield phrase(returned_phrase[0], returned_phrase[1], returned_phrase[2], -1, returned_phrase[3] == 1)
+
+def list_phrases(cur, output, output_format='text', **filters):
+    """
+    Writes the phrases matching filters (see iter_phrases()) to output as
+    they are read: one phrase per line for 'text', or as 'csv' (which
+    --import-phrases can read back) or a 'json' array
+    Returns the number of phrases written
+    """
+    count = 0
+    if output_format == 'csv':
+        import csv
+        writer = csv.writer(output)
+        writer.writerow(['phrase_id', 'phrase', 'list', 'enabled'])
+        for phrase_obj in iter_phrases(cur, **filters):
+            writer.writerow([phrase_obj.phrase_id, phrase_obj.text, phrase_obj.origin_list, int(phrase_obj.enabled)])
+            count += 1
+    elif output_format == 'json':
+        import json
+        output.write('[')
+        for phrase_obj in iter_phrases(cur, **filters):
+            if count > 0:
+                output.write(',')
+            output.write('\n  ' + json.dumps({'phrase_id': phrase_obj.phrase_id, 'phrase': phrase_obj.text, 'list': phrase_obj.origin_list, 'enabled': phrase_obj.enabled}))
+            count += 1
+        output.write('\n]\n')
+    else:
+        for phrase_obj in iter_phrases(cur, **filters):
+            output.write(str(phrase_obj) + '\n')
+            count += 1
+    return count
 
 def add_phrase_to_database(cur, conn, phrase, origin_list):
+    """
+    Adds a single enabled phrase
+    Returns its phrase_id, or None if it is already present or couldn't be
+    added
+    """
     global logger
 
+    cur.execute('SELECT phrase_id FROM phrases WHERE phrase = ?', (phrase,))
+    if cur.fetchone() != None:
+        logger.debug("Phrase '%s' is already present in the database", phrase)
+        return None
+
+    logger.debug("Phrase '%s' does not exist in the database, adding", phrase)
     try:
-        cmd = 'SELECT rowid,phrase FROM phrases where phrase="%s"' % phrase
-        cur.execute(cmd)
+        cur.execute('INSERT INTO phrases (phrase, list, enabled) VALUES (?, ?, 1)', (phrase, origin_list))
         conn.commit()
-
-        returned = cur.fetchall()[0]
-        # If we make it this far, that means that there *is* already that phrase present in the database, so we should return None to signal that
-        logger.debug("Phrase '%s' is already present in the database" % phrase)
+    except sqlite3.Error:
+        logger.error("Error inserting '%s' into the database", phrase)
         return None
+    return cur.lastrowid
+
+def import_phrases(cur, conn, csv_file_name, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Streams phrases from a CSV file (with 'phrase' and 'list' columns) into the
+    database. Rows are inserted in chunks of chunk_size, all inside a single
+    transaction, and duplicates are skipped by the unique constraint on phrase.
+    Returns a tuple of (inserted, skipped), or None if the import failed
+    """
+    global logger
+
+    try:
+        import csv
     except:
-        # There are no items in the database with that phrase
-        logger.debug("Phrase '%s' does not exist in the database, adding" % phrase)
-        pass
+        logger.error("Error importing CSV module")
+        return None
 
-    # Now we can try to add it to the database
+    cmd = 'INSERT OR IGNORE INTO phrases (phrase, list, enabled, sort_key) VALUES (?, ?, 1, ?)'
+    rows_read = 0
+    # Counted from rowcount, which unlike total_changes leaves out rows
+    # changed by triggers
+    inserted = 0
+    import_start_time = time.monotonic()
+
+    logger.debug("Opening file: %s", csv_file_name)
     try:
-        cmd = 'INSERT INTO phrases (phrase, list, enabled) VALUES ("%s", "%s", "True")' % (phrase, origin_list)
-        cur.execute(cmd)
+        cur.execute('SELECT coalesce(max(sort_key), 0) FROM phrases')
+        highest_sort_key = cur.fetchone()[0]
+        with open(csv_file_name, newline='') as csvfile:
+            logger.debug("Initializing DictReader for CSV")
+            reader = csv.DictReader(csvfile)
+            for column in ('phrase', 'list'):
+                if reader.fieldnames == None or column not in reader.fieldnames:
+                    logger.error("Import file not properly formatted, no '%s' column found with appropriate identification in first row", column)
+                    return None
+
+            chunk = []
+            logger.debug("Iterating through file")
+            for row in reader:
+                chunk.append((row['phrase'], row['list'], highest_sort_key + random.randint(1, PHRASE_SORT_KEY_SPAN)))
+                if len(chunk) >= chunk_size:
+                    cur.executemany(cmd, chunk)
+                    inserted += cur.rowcount
+                    rows_read += len(chunk)
+                    logger.debug("Inserted chunk; %d rows read so far", rows_read)
+                    chunk = []
+            if chunk:
+                cur.executemany(cmd, chunk)
+                inserted += cur.rowcount
+                rows_read += len(chunk)
         conn.commit()
-    except sqlite3.OperationalError:
-        logger.error("Error inserting '%s' into the database" % phrase)
+    except (OSError, csv.Error, sqlite3.Error) as e:
+        conn.rollback()
+        logger.error("Error importing phrases from '%s': %s", csv_file_name, e)
         return None
 
-    # Now we get the rowid of the phrase to return it
+    elapsed = max(time.monotonic() - import_start_time, 0.000001)
+    skipped = rows_read - inserted
+    logger.info("Imported %d phrases, skipped %d already present (%d rows in %.2f s, %d rows/s)", inserted, skipped, rows_read, elapsed, rows_read / elapsed)
+    return (inserted, skipped)
+
+def change_phrases(cur, conn, action, dry_run=False, **filters):
+    """
+    Disables, enables or removes (action 'disable', 'enable' or 'remove')
+    every phrase matching filters (see phrase_filter()) in one transaction.
+    Removing a phrase also drops its statistics and schedules; its answers
+    stay in response_history. Phrase ids, an id range, a list name or a
+    pattern must be given, so that a typo can't change the whole library; the
+    enabled state only narrows those down. With dry_run nothing is changed
+    Returns the number of phrases matched, or None on failure
+    """
+    global logger
+
+    if all(filters.get(name) in (None, [], '') for name in ('id_ranges', 'min_id', 'max_id', 'list_name', 'pattern')):
+        logger.error("No phrases selected; give phrase ids, --min-id/--max-id, a list name or a pattern")
+        return None
+    where, params = phrase_filter(**filters)
+
+    if dry_run:
+        cmd = 'SELECT count(*) FROM phrases' + where
+        logger.debug("SQLite command: %s", cmd)
+        cur.execute(cmd, params)
+        return cur.fetchone()[0]
+
+    if action == 'remove':
+        commands = ['DELETE FROM phrase_stats WHERE phrase_id IN (SELECT phrase_id FROM phrases' + where + ')',
+                    'DELETE FROM phrase_schedule WHERE phrase_id IN (SELECT phrase_id FROM phrases' + where + ')',
+                    'DELETE FROM phrases' + where]
+    else:
+        commands = ['UPDATE phrases SET enabled = ?' + where]
+        params = [1 if action == 'enable' else 0] + list(params)
+
     try:
-        cmd = 'SELECT rowid,phrase FROM phrases where phrase="%s"' % phrase
-        cur.execute(cmd)
+        cur.execute('BEGIN')
+        for cmd in commands:
+            logger.debug("SQLite command: %s", cmd)
+            cur.execute(cmd, params)
+        changed = cur.rowcount
         conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error("Could not %s phrases: %s", action, e)
+        return None
+    return changed
 
-        rowid = cur.fetchall()[0][0]
-        return rowid
-    except:
-        pass
+def get_archive_file_name(curr_loc):
+    return curr_loc + os.sep + "archive" + os.sep + ARCHIVE_FILE_NAME
 
-def delete_phrase(cur, conn, phrase_id):
+def iter_archived_columns(archive_file_name, learner_id, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """
+    Reads the archive file chunk_size lines at a time, each chunk parsed by
+    NumPy rather than row by row in Python, and picks out the learner's
+    timed answers with array masks
+    Yields (phrase_id, batch_id, time_ms, correct) arrays for each chunk,
+    typed as load_response_columns() returns them; nothing if there is no
+    archive
+    """
+    import itertools
+    import numpy
+
+    if not os.path.exists(archive_file_name):
+        return
+    # The answer time is read as text, as it can be empty
+    dtype = [('phrase_id', numpy.int32), ('batch_id', numpy.int32), ('time_ms', 'U24'), ('status', 'U9'), ('learner_id', numpy.int64)]
+    usecols = [ARCHIVE_COLUMNS.index(name) for name in ('phrase_id', 'batch_id', 'response_time_ms', 'response_status', 'learner_id')]
+    # Each archive run appends another gzip member; gzip reads them in turn.
+    # Only the first starts with the header row
+    with gzip.open(archive_file_name, 'rt', newline='') as archive_file:
+        archive_file.readline()
+        while True:
+            lines = list(itertools.islice(archive_file, chunk_size))
+            if not lines:
+                break
+            fields = numpy.loadtxt(lines, dtype=dtype, delimiter=',', quotechar='"', usecols=usecols, ndmin=1)
+            fields = fields[(fields['learner_id'] == learner_id) & (fields['time_ms'] != '')]
+            yield (fields['phrase_id'], fields['batch_id'], fields['time_ms'].astype(numpy.float32), fields['status'] == "Correct")
+
+def archive_responses(cur, conn, cutoff, archive_file_name):
+    """
+    Moves answers from batches started before cutoff (a 'YYYY-MM-DD' date, in
+    UTC) out of response_history and appends them to archive_file_name, a
+    gzip'd CSV file. Batches from before start times were recorded count as
+    older than any cutoff. The rows are only deleted, in one transaction,
+    once the archive is safely on disk; the freed pages are then handed back
+    with an incremental vacuum. Statistics and schedules are left alone, as
+    they already include the archived answers
+    Returns the number of answers archived, or None on failure
+    """
     global logger
-    logger.debug("Entered delete_phrase() routine")
+
+    import csv
+
+    select = ('SELECT response_id, response_history.batch_id, phrase_id, response_time_ms, response_status, render_to_flip_ms, flip_to_input_ms, response_history.learner_id, batches.start_time '
+              'FROM response_history LEFT JOIN batches ON batches.batch_id = response_history.batch_id '
+              'WHERE batches.start_time IS NULL OR batches.start_time < ? ORDER BY response_id')
+    archived = 0
+    last_response_id = None
+
     try:
-        cmd = 'DELETE FROM phrases where rowid=%s' % phrase_id
-        logger.debug("SQLite command: %s" % cmd)
-        cur.execute(cmd)
+        archive_directory = os.path.dirname(archive_file_name)
+        if not os.path.isdir(archive_directory):
+            os.mkdir(archive_directory)
+        new_file = not os.path.exists(archive_file_name)
+        # Appending adds a new gzip member, leaving what's there untouched
+        with gzip.open(archive_file_name, 'at', newline='') as archive_file:
+            writer = csv.writer(archive_file)
+            if new_file:
+                writer.writerow(ARCHIVE_COLUMNS)
+            cur.execute(select, (cutoff,))
+            while True:
+                rows = cur.fetchmany(IMPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                archived += len(rows)
+                last_response_id = rows[-1][0]
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+    except OSError as e:
+        logger.error("Could not write archive '%s': %s", archive_file_name, e)
+        return None
+
+    if archived == 0:
+        return 0
+
+    try:
+        cur.execute('BEGIN')
+        cur.execute('DELETE FROM response_history WHERE response_id <= ? AND response_id IN (SELECT response_id FROM response_history LEFT JOIN batches ON batches.batch_id = response_history.batch_id WHERE batches.start_time IS NULL OR batches.start_time < ?)',
+                    (last_response_id, cutoff))
         conn.commit()
-        logger.debug("Successful commit, returning 1 from delete_phrase()")
-        return 1
-    except:
-        logger.debug("Error deleting phrase id %s from database" % phrase_id)
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error("Archived %d answers to '%s' but could not remove them from the database: %s", archived, archive_file_name, e)
+        return None
+
+    compact_database(cur, conn)
+    return archived
+
+def compact_database(cur, conn):
+    """
+    Returns free pages to the file system. The first time, this switches the
+    database to incremental auto-vacuum, which takes a full VACUUM; after
+    that only the free pages are touched
+    """
+    global logger
+
+    cur.execute('PRAGMA auto_vacuum')
+    if cur.fetchone()[0] != 2:
+        logger.info("Switching database to incremental vacuuming (one-off full vacuum)")
+        cur.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cur.execute('VACUUM')
+    else:
+        cur.execute('PRAGMA freelist_count')
+        logger.debug("Vacuuming %d free pages", cur.fetchone()[0])
+        cur.execute('PRAGMA incremental_vacuum')
+        cur.fetchall()
+
+def delete_phrase(cur, conn, phrase_id):
+    global logger
+    logger.debug("Entered delete_phrase() routine")
+    if change_phrases(cur, conn, 'remove', id_ranges=[(phrase_id, phrase_id)]) != 1:
+        logger.debug("Error deleting phrase id %s from database", phrase_id)
         return 0
+    return 1
 
 def disable_phrase(cur, conn, phrase_id):
     global logger
     logger.debug("Entered disable_phrase() routine")
-
-    try:
-        cmd = 'UPDATE phrases SET enabled="False" where rowid=%s' % phrase_id
-        logger.debug("SQLite command: %s" % cmd)
-        cur.execute(cmd)
-        conn.commit()
-        logger.debug("Successful commit, returning 1 from disable_phrase()")
-        return 1
-    except:
-        logger.debug("Error disabling phrase id %s in database" % phrase_id)
+    if change_phrases(cur, conn, 'disable', id_ranges=[(phrase_id, phrase_id)]) != 1:
+        logger.debug("Error disabling phrase id %s in database", phrase_id)
         return 0
+    return 1
 
-def quit_sightright(error_level):
+def get_game_events():
+    """
+    Returns the events for an idle game state to handle. Sleeps until there
+    is at least one (a keypress, or the splash timer) rather than waking up
+    60 times a second to look, unless --poll-loop was given.
+    last_event_time is set to when the events were received; pygame events
+    carry no timestamp, so this is the closest we get to when a key went down
+    """
+    global last_event_time
+    global event_wait_ms
+
+    if poll_loop:
+        events = pygame.event.get()
+        last_event_time = time.monotonic()
+        return events
+
+    if profiling:
+        wait_start_time = time.perf_counter()
+    events = [pygame.event.wait()]
+    last_event_time = time.monotonic()
+    if profiling:
+        event_wait_ms += profile_section('events/wait', wait_start_time)
+    events.extend(pygame.event.get())
+    return events
+
+def start_cpu_measurement(state):
+    global cpu_measurement
+    cpu_measurement = (state, time.monotonic(), time.process_time())
+
+def stop_cpu_measurement():
+    """
+    Adds the time since start_cpu_measurement() to the totals for its state
+    """
+    global cpu_measurement
+    global cpu_usage
+
+    if cpu_measurement == None:
+        return
+    state, wall_start_time, cpu_start_time = cpu_measurement
+    usage = cpu_usage.setdefault(state, [0.0, 0.0])
+    usage[0] += time.monotonic() - wall_start_time
+    usage[1] += time.process_time() - cpu_start_time
+    cpu_measurement = None
+
+def profile_section(section, start_time, idle_ms=0.0):
+    """
+    Adds the time since start_time (a time.perf_counter() reading), less
+    idle_ms, to section's timings in profile_timings (see --profile)
+    Returns the time added, in ms
+    """
+    global profile_timings
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000 - idle_ms
+    timings = profile_timings.get(section)
+    if timings == None:
+        timings = profile_timings[section] = [[0] * (len(PROFILE_HISTOGRAM_BOUNDS_MS) + 1), 0, 0.0, 0.0]
+    timings[0][bisect.bisect_left(PROFILE_HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+    timings[1] += 1
+    timings[2] += elapsed_ms
+    if elapsed_ms > timings[3]:
+        timings[3] = elapsed_ms
+    return elapsed_ms
+
+def get_profile_file_name(curr_loc):
+    """
+    Returns the name of the --profile summary file for this run, in the logs
+    folder alongside the log files, creating the folder if need be
+    Returns the file name
+    """
+    global start_time
+
+    profile_file_name = "sightright_profile_" + strftime("%Y%m%d_%H%M%S", start_time) + ".txt"
+    log_directory = curr_loc + os.sep + "logs"
+    if not os.path.isdir(log_directory):
+        try:
+            os.mkdir(log_directory)
+        except OSError:
+            # Next to the database, then
+            return curr_loc + os.sep + profile_file_name
+    return log_directory + os.sep + profile_file_name
+
+def write_profile_summary(profile_file_name):
+    """
+    Writes the number of timings, total, mean, PROFILE_PERCENTILES and
+    maximum of each section in profile_timings to profile_file_name.
+    Percentiles are the upper bound of the bucket they land in, so are
+    within 25% of the true value (and never more than the maximum)
+    Returns the number of sections written, or None if the file could not
+    be written
+    """
     global logger
-    if error_level != 0:
-        logger.warning("SightRight is exiting with a non-zero exit code: %d" % error_level)
-    logger.info('SightRight execution finished')
-    #logger.flush()
-    #logger.close()
-    sys.exit(error_level)
+    global profile_timings
+    global start_time
+    global poll_loop
+
+    lines = ["SightRight profile, %s, %s game loop" % (strftime("%Y-%m-%d %H:%M:%S", start_time), "polling" if poll_loop else "event-driven"),
+             "Times in ms. state/ sections are the work done in each pass through a game",
+             "state, not counting time asleep waiting for events (events/wait)",
+             ""]
+    lines.append("%-28s %8s %11s %9s" % ("section", "count", "total", "mean") +
+                 "".join(" %9s" % ("p%d" % round(fraction * 100)) for fraction in PROFILE_PERCENTILES) + " %9s" % "max")
+    for section in sorted(profile_timings):
+        histogram, count, total_ms, max_ms = profile_timings[section]
+        line = "%-28s %8d %11.3f %9.3f" % (section, count, total_ms, total_ms / count)
+        for fraction in PROFILE_PERCENTILES:
+            line += " %9.3f" % min(phrase_stats_percentile(histogram, fraction, PROFILE_HISTOGRAM_BOUNDS_MS), max_ms)
+        lines.append(line + " %9.3f" % max_ms)
 
-# Set up argument parser
-parser = argparse.ArgumentParser(description='A flash card game for parents and children to play together')
+    try:
+        with open(profile_file_name, 'w') as profile_file:
+            profile_file.write("\n".join(lines) + "\n")
+    except OSError as e:
+        logger.error("Could not write profile to %s: %s", profile_file_name, e)
+        return None
+    return len(profile_timings)
 
-parser.add_argument('-l', '--list-phrases',
-                    action="store_const", const="list_phrases",
-                    dest="list_phrases",
-                    help='List phrases stored in the database')
+def report_cpu_usage():
+    """
+    Logs the wall clock and CPU time spent in each game state, and totals for
+    the idle and active states (see --measure-cpu)
+    """
+    global logger
+    global cpu_usage
 
-parser.add_argument('-i', '--import-phrases',
-                    action="store", dest="import_phrases",
-                    help='Import a CSV file of phrases into the database')
+    if poll_loop:
+        logger.info("CPU usage for polling game loop (60 Hz):")
+    else:
+        logger.info("CPU usage for event-driven game loop:")
 
-parser.add_argument('-d', '--disable-phrase',
-                    action="store",
-                    dest="disable_phrase_id",
-                    help='Disable phrase (by id)')
+    totals = {'idle': [0.0, 0.0], 'active': [0.0, 0.0]}
+    for state in sorted(cpu_usage):
+        wall_time, cpu_time = cpu_usage[state]
+        logger.info("  %-16s wall %8.3f s  cpu %8.3f s  (%5.1f%%)", GAME_STATE_NAMES[state], wall_time, cpu_time, cpu_time / max(wall_time, 0.000001) * 100)
+        group = 'idle' if state in IDLE_GAME_STATES else 'active'
+        totals[group][0] += wall_time
+        totals[group][1] += cpu_time
 
-parser.add_argument('-r', '--remove-phrase',
-                    action="store",
-                    dest="remove_phrase_id",
-                    help='Remove a phrase (by id) from the database')
+    for group in ('idle', 'active'):
+        wall_time, cpu_time = totals[group]
+        logger.info("  %-16s wall %8.3f s  cpu %8.3f s  (%5.1f%%)", group + ' states', wall_time, cpu_time, cpu_time / max(wall_time, 0.000001) * 100)
 
-parser.add_argument('--log',
-                    action="store_const",
-                    const=True,
-                    dest="logging_enabled",
-                    help='Enable text logs of runtime (mostly for debugging)')
+def load_pygame():
+    """
+    Imports pygame the first time it is needed
+    Returns the pygame module
+    """
+    global logger
+    global pygame
 
-parser.add_argument('--debug',
-                    action="store_const",
-                    const=True,
-                    dest="debug",
-                    help='Enable debug output, for more verbosity')
+    if pygame == None:
+        logger.debug("Importing pygame")
+        import pygame
+    return pygame
 
-arguments = parser.parse_args()
+def quit_sightright(error_level):
+    global logger
+    global response_log
+    global window_fetcher
+    global endless_batch_id
+    global current_directory
+    global profiling
+    global profile_timings
+    global cprofile_profiler
+    global cprofile_file_name
+
+    # Make sure every answer given so far reaches the database
+    if response_log != None:
+        logger.debug("Flushing queued responses to the database")
+        if not response_log.close(RESPONSE_FLUSH_TIMEOUT):
+            logger.error("Gave up waiting for %d queued answers and the answers being written", response_log.pending.qsize())
+        response_log = None
+
+    if window_fetcher != None:
+        window_fetcher.close()
+        window_fetcher = None
+
+    # An endless session only ends here
+    if endless_batch_id != None:
+        if server_session != None:
+            server_session.finish_batch(endless_batch_id)
+        else:
+            finish_batch(cursor, connection, endless_batch_id)
+        endless_batch_id = None
 
-# Implicitly turn on text logs if --debug is enabled
-# Explicitly turn on text logs if --log is enabled
-if arguments.debug or debug_on or arguments.logging_enabled:
-    logging_enabled = True
-else:
-    logging_enabled = False
+    if measure_cpu:
+        # Quitting from inside the game loop; count the pass that was cut short
+        stop_cpu_measurement()
+        report_cpu_usage()
 
-if arguments.debug:
-    debug_on = True
+    if profiling and profile_timings:
+        profile_file_name = get_profile_file_name(current_directory)
+        if write_profile_summary(profile_file_name) != None:
+            logger.info("Wrote profile of %d sections to %s", len(profile_timings), profile_file_name)
 
-setup_logging()
+    if cprofile_profiler != None:
+        cprofile_profiler.disable()
+        cprofile_profiler.dump_stats(cprofile_file_name)
+        logger.info("Wrote cProfile statistics to %s; read them with python3 -m pstats %s", cprofile_file_name, cprofile_file_name)
 
-# Set the logging level to debug if --debug was specified
-#if arguments.debug or debug_on:
+    if error_level != 0:
+        dump_trace()
+        logger.warning("SightRight is exiting with a non-zero exit code: %d", error_level)
+    logger.info('SightRight execution finished')
+    stop_logging()
+    sys.exit(error_level)
 
+def refill_phrase_window():
+    """
+    In endless mode, once only ENDLESS_REFILL_AT words of the window are left,
+    asks window_fetcher for the next ENDLESS_WINDOW_SIZE phrases, and once
+    they have arrived drops the words already shown and puts the new ones on
+    the end. Called while the splash is up, and never waits for the fetch,
+    so the game carries on however slow the database or session server is
+    Returns False once there are no more phrases to fetch, True otherwise
+    """
+    global logger
+    global phrases
+    global total_words
+    global window_start
+    global window_fetcher
+    global phrase_font_sizes
+
+    fetched = window_fetcher.take()
+    if fetched != None:
+        rows, font_sizes = fetched
+        if rows == None:
+            # Asked for again below
+            logger.warning("Could not fetch the next phrases; trying again")
+        elif len(rows) == 0:
+            logger.info("No more phrases to add to the session")
+            return False
+        else:
+            window = phrase_batch(phrases.batch_id)
+            for index in range(current_phrase_number - window_start, len(phrases)):
+                window.append(phrases.phrase_ids[index], phrases.texts[index])
+            window.extend_from_rows(rows)
+            # Phrases without a stored size are fitted by render_phrase()
+            phrase_font_sizes.update(font_sizes)
+            phrases = window
+            window_start = current_phrase_number
+            total_words = window_start + len(phrases)
+            trace('refill', len(rows))
+            logger.debug("Added %d more phrases; words %d to %d are ready", len(rows), window_start + 1, total_words)
+
+    if total_words - current_phrase_number <= ENDLESS_REFILL_AT:
+        window_fetcher.request(ENDLESS_WINDOW_SIZE, learners[current_learner][0], set(phrases.phrase_ids))
+    return True
 
 def game_loop():
     global logger
@@ -567,21 +2599,40 @@ def game_loop():
 
     global cursor
     global connection
+    global response_log
+    global server_session
+    global current_learner
+    global words_per_batch
+    global endless_mode
+    global endless_batch_id
+    global window_start
+    global event_wait_ms
 
     logger.debug("Game loop beginning")
-    logger.debug("Current word is: %s" % current_phrase.text)
+    logger.debug("Current word is: %s", current_phrase.text)
 
     game_exit = False
+    state_entered_time = time.monotonic()
 
     while game_exit == False:
+        pass_state = game_state
+        if measure_cpu:
+            start_cpu_measurement(game_state)
+        if profiling:
+            event_wait_ms = 0.0
+            pass_start_time = time.perf_counter()
+
         if game_state == BATCH_START:
             # Don't update the display here, it makes the debug logs too chatty
             # Instead update the display immediately after setting the state to BATCH_END
             # elsewhere in the code
             # update_display()
 
+            # Get the first word ready while waiting
+            render_phrase(phrases[current_phrase_number - window_start].text, white, black)
+
             # Wait for a keypress to continue
-            for event in pygame.event.get():
+            for event in get_game_events():
                 if event.type == pygame.QUIT:
                     logger.debug("Quit event detected")
                     quit_sightright(0)
@@ -591,6 +2642,28 @@ def game_loop():
                 elif event.type == pygame.KEYDOWN and event.key == pygame.K_q:
                     logger.debug("Keyboard `q` detected")
                     quit_sightright(0)
+                elif event.type == pygame.KEYDOWN and event.key in (pygame.K_LEFT, pygame.K_RIGHT) and len(learners) > 1:
+                    # Switch learner, and pick the new learner's words
+                    step = 1 if event.key == pygame.K_RIGHT else -1
+                    current_learner = (current_learner + step) % len(learners)
+                    logger.debug("Changing learner to %s", learners[current_learner][1])
+                    if profiling:
+                        reschedule_start_time = time.perf_counter()
+                    if server_session != None:
+                        phrases = server_session.reschedule_phrase_batch(phrases, words_per_batch, learners[current_learner][0])
+                        if phrases == None:
+                            quit_sightright(1)
+                    else:
+                        phrases = reschedule_phrase_batch(cursor, connection, phrases, words_per_batch, learners[current_learner][0])
+                    total_words = len(phrases)
+                    if total_words <= 0:
+                        logger.warning("No phrases returned from database; database likely empty")
+                        quit_sightright(1)
+                    load_phrase_font_sizes(cursor, connection, phrases.texts)
+                    if profiling:
+                        profile_section('database/reschedule_batch', reschedule_start_time)
+                    current_phrase = phrases[current_phrase_number - window_start]
+                    update_display()
                 elif event.type == pygame.KEYDOWN:
                     logger.debug("Setting state to PRESENT_WORD")
                     game_state = PRESENT_WORD
@@ -598,13 +2671,14 @@ def game_loop():
         elif game_state == PRESENT_WORD:
             current_phrase_number += 1
             # Choose the next word and set it
-            current_phrase = phrases[current_phrase_number - 1]
+            current_phrase = phrases[current_phrase_number - 1 - window_start]
 
             # Display the word
             update_display()
 
-            # Keep track of the tick when the word was rendered (for timekeeping)
-            last_word_display_time = time.monotonic()
+            # Answers are timed from when the word actually reached the screen
+            last_word_display_time = last_flip_time
+            word_render_ms = last_render_ms
             # Clear the event queue
             pygame.event.clear()
             # Transition to next state
@@ -612,7 +2686,12 @@ def game_loop():
             game_state = ACCEPT_INPUT
 
         elif game_state == ACCEPT_INPUT:
-            for event in pygame.event.get():
+            # While waiting for an answer, get the word ready in the colours
+            # used to show either result
+            render_phrase(current_phrase.text, green, white)
+            render_phrase(current_phrase.text, black, white)
+
+            for event in get_game_events():
                 if event.type == pygame.QUIT:
                     logger.debug("Quit event detected")
                     quit_sightright(0)
@@ -620,11 +2699,13 @@ def game_loop():
                     # Down pressed
                     # Bad guess
                     logger.debug("Keyboard `arrow down` detected")
+                    answer_time = last_event_time
                     game_state = INCORRECT_GUESS
                 elif event.type == pygame.KEYDOWN and event.key == pygame.K_UP:
                     # Up pressed
                     # Good guess
                     logger.debug("Keyboard `arrow up` detected")
+                    answer_time = last_event_time
                     game_state = CORRECT_GUESS
                 elif event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHT:
                     # Right pressed
@@ -646,16 +2727,18 @@ def game_loop():
             words_attempted += 1
             score += 1
 
-            # Calculate number of milliseconds since word was displayed
-            answer_time = time.monotonic()
-            answer_delay_ms = int((answer_time - last_word_display_time) * 1000)
+            # Calculate number of milliseconds from the word reaching the
+            # screen to the key being pressed
+            flip_to_input_ms = (answer_time - last_word_display_time) * 1000
+            answer_delay_ms = int(flip_to_input_ms)
+            logger.debug("Answer latency %.1f ms (word took %.1f ms to draw)", flip_to_input_ms, word_render_ms)
 
             # Render the word as correct
-            logger.debug("Rendering current word '%s' as correct" % current_phrase.text)
+            logger.debug("Rendering current word '%s' as correct", current_phrase.text)
             update_display()
 
             # Log to database
-            log_phrase_result(cursor, connection, current_phrase.batch_id, current_phrase.phrase_id, answer_delay_ms, "Correct")
+            response_log.log(current_phrase.batch_id, current_phrase.phrase_id, answer_delay_ms, "Correct", word_render_ms, flip_to_input_ms, learners[current_learner][0])
 
             # Set up timer
             logger.debug("Setting new timer for display")
@@ -672,16 +2755,18 @@ def game_loop():
             # Increment the number of attempts, for scoring purposes
             words_attempted += 1
 
-            # Calculate number of milliseconds since word was displayed
-            answer_time = time.monotonic()
-            answer_delay_ms = int((answer_time - last_word_display_time) * 1000)
+            # Calculate number of milliseconds from the word reaching the
+            # screen to the key being pressed
+            flip_to_input_ms = (answer_time - last_word_display_time) * 1000
+            answer_delay_ms = int(flip_to_input_ms)
+            logger.debug("Answer latency %.1f ms (word took %.1f ms to draw)", flip_to_input_ms, word_render_ms)
 
             # Render the word as incorrect
-            logger.debug("Rendering current word '%s' as incorrect" % current_phrase.text)
+            logger.debug("Rendering current word '%s' as incorrect", current_phrase.text)
             update_display()
 
             # Log to database
-            log_phrase_result(cursor, connection, current_phrase.batch_id, current_phrase.phrase_id, answer_delay_ms, "Incorrect")
+            response_log.log(current_phrase.batch_id, current_phrase.phrase_id, answer_delay_ms, "Incorrect", word_render_ms, flip_to_input_ms, learners[current_learner][0])
 
             # Set up timer
             logger.debug("Setting new timer for display")
@@ -692,7 +2777,15 @@ def game_loop():
             game_state = DISPLAY_WAIT
 
         elif game_state == DISPLAY_WAIT:
-            for event in pygame.event.get():
+            # Fetch and render the next word while the splash is up, so that
+            # PRESENT_WORD only has to blit it
+            more_phrases = False
+            if endless_mode:
+                more_phrases = refill_phrase_window()
+            if current_phrase_number < total_words:
+                render_phrase(phrases[current_phrase_number - window_start].text, white, black)
+
+            for event in get_game_events():
                 # print(event)
                 # Check to see if the timer has lapsed
                 if event.type == pygame.USEREVENT + 1:
@@ -701,11 +2794,31 @@ def game_loop():
                     # Unset timer
                     pygame.time.set_timer(pygame.USEREVENT + 1, 0)
 
-                    if current_phrase_number == total_words:
+                    if current_phrase_number == total_words and more_phrases:
+                        # The next endless window is still on its way
+                        pygame.time.set_timer(pygame.USEREVENT + 1, ENDLESS_WAIT_DELAY)
+                    elif current_phrase_number == total_words:
                         # We have reached the target number of words
                         # Time to leave the user no option but to quit
                         logger.debug("Setting state to BATCH_END")
                         game_state = BATCH_END
+                        # The round is over, so it's a good time to wait for the writer
+                        if profiling:
+                            flush_start_time = time.perf_counter()
+                        if not response_log.flush(RESPONSE_FLUSH_TIMEOUT):
+                            logger.warning("Answers are still being written; finishing the batch anyway")
+                        if profiling:
+                            finish_start_time = time.perf_counter()
+                            profile_section('database/flush_answers', flush_start_time)
+                        if server_session != None:
+                            server_session.finish_batch(phrases.batch_id)
+                        else:
+                            finish_batch(cursor, connection, phrases.batch_id)
+                        # An endless session that ran out of phrases is finished
+                        # now, not again on the way out
+                        endless_batch_id = None
+                        if profiling:
+                            profile_section('database/finish_batch', finish_start_time)
                         # Update the display here so that we don't have to do it in the game_state == BATCH_END
                         # That causes unnecessarily chatty debug logs
                         update_display()
@@ -768,7 +2881,7 @@ def game_loop():
             # Instead update the display immediately after setting the state to BATCH_END
             # elsewhere in the code
             # update_display()
-            for event in pygame.event.get():
+            for event in get_game_events():
                 if event.type == pygame.QUIT:
                     logger.debug("Quit event detected")
                     quit_sightright(0)
@@ -778,173 +2891,1028 @@ def game_loop():
                 elif event.type == pygame.KEYDOWN and event.key == pygame.K_q:
                     logger.debug("Keyboard `q` detected")
                     quit_sightright(0)
-        # logger.debug("Ticking clock")
-        game_clock.tick(60)
+        if poll_loop:
+            # logger.debug("Ticking clock")
+            if profiling:
+                wait_start_time = time.perf_counter()
+            game_clock.tick(60)
+            if profiling:
+                event_wait_ms += profile_section('events/wait', wait_start_time)
+
+        if measure_cpu:
+            stop_cpu_measurement()
+        if profiling:
+            profile_section('state/' + GAME_STATE_NAMES[pass_state], pass_start_time, event_wait_ms)
+
+        if game_state != pass_state:
+            # Note how long the state lasted, not just this pass through it
+            state_left_time = time.monotonic()
+            trace('state', GAME_STATE_NAMES[pass_state], GAME_STATE_NAMES[game_state], (state_left_time - state_entered_time) * 1000)
+            state_entered_time = state_left_time
 
     logger.debug("Game loop end")
 
-# End function definitions
+################################################################################
+# Session server                                                               #
+################################################################################
 
+def parse_server_address(address):
+    """
+    Returns (host, port) from 'host:port', or just 'port' for this machine
+    """
+    host, separator, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port))
 
-# Begin main execution
+class database_lane:
+    """
+    A database connection with a thread of its own. Each lane's connection
+    is only ever used on its thread, so the event loop can hand blocking
+    queries to a lane and carry on serving other clients
+    """
 
-if does_database_exist(current_directory):
-    # Database was found
-    logger.debug("Database file is present")
-    connection = connect_database(current_directory)
+    def __init__(self, curr_loc):
+        import concurrent.futures
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='database_lane')
+        self.executor.submit(self.connect, curr_loc).result()
 
-    if not connection:
-        # Error connecting to database
-        logger.error("Could not connect to SightRight database file!")
-        quit_sightright(CANNOT_CONNECT_TO_DATABASE)
-    else:
-        # Database connection successful
-        logger.debug("Database connection successful")
-        cursor = connection.cursor()
-else:
-    # Database was not found
-    logger.info("SightRight database missing. Creating...")
-
-    # Create the database
-    connection = connect_database(current_directory)
-
-    if not connection:
-        # Error connecting to newly-created database
-        logger.critical("Could not connect to SightRight database file!")
-        quit_sightright(CANNOT_CONNECT_TO_DATABASE)
-    else:
-        # Successful creating and connecting to database
-        logger.info("SightRight database created")
-        cursor = connection.cursor()
-        setup_database(cursor, connection)
-        logger.info("Database setup complete")
+    def connect(self, curr_loc):
+        self.conn = connect_database(curr_loc)
+        self.cur = self.conn.cursor()
+
+    def run(self, function):
+        """
+        Returns an awaitable for function(cur, conn), run on the lane's thread
+        """
+        import asyncio
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, self.cur, self.conn)
+
+    def close(self):
+        self.executor.submit(self.conn.close).result()
+        self.executor.shutdown()
+
+class session_server:
+    """
+    Serves phrase batches, answers, learners and the phrase list to kiosks
+    over HTTP/JSON, from one database. Queries run on a bounded pool of
+    database_lanes; writes that hand out ids (new batches, imports) take
+    write_lock so two clients are never given the same batch. Answers go
+    through a response_writer, so answers from every kiosk that arrive
+    together are committed in one transaction
+    """
 
-if arguments.import_phrases:
+    def __init__(self, curr_loc, pool_size=SERVER_POOL_SIZE):
+        self.curr_loc = curr_loc
+        self.pool_size = pool_size
+
+    async def serve(self, host, port):
+        import asyncio
+        global logger
+
+        self.lanes = asyncio.Queue()
+        for i in range(self.pool_size):
+            self.lanes.put_nowait(database_lane(self.curr_loc))
+        self.write_lock = asyncio.Lock()
+        self.responses = response_writer(self.curr_loc)
+        if not self.responses.connected:
+            logger.critical("Could not open the database for recording answers")
+            while not self.lanes.empty():
+                self.lanes.get_nowait().close()
+            return False
+
+        try:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        except OSError as e:
+            logger.critical("Could not listen on %s:%d: %s", host, port, e)
+            self.responses.close()
+            while not self.lanes.empty():
+                self.lanes.get_nowait().close()
+            return False
+        logger.info("Serving sessions on %s:%d with %d database connections", host, port, self.pool_size)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.responses.close()
+            while not self.lanes.empty():
+                self.lanes.get_nowait().close()
+
+    async def query(self, function, write=False):
+        """
+        Runs function(cur, conn) on the next free database lane
+        Returns what function returned
+        """
+        if write:
+            async with self.write_lock:
+                return await self.query(function)
+        lane = await self.lanes.get()
+        try:
+            return await lane.run(function)
+        finally:
+            self.lanes.put_nowait(lane)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers HTTP/1.1 requests on one client connection until the client
+        closes it or leaves it idle for SERVER_IDLE_TIMEOUT seconds
+        """
+        import asyncio
+        import json
+        import urllib.parse
+        global logger
+
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), SERVER_IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, separator, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > SERVER_MAX_REQUEST_BYTES:
+                    status, content = 413, {'error': 'request too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    url = urllib.parse.urlsplit(target)
+                    status, content = await self.dispatch(method, url.path, dict(urllib.parse.parse_qsl(url.query)), body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if not isinstance(content, str):
+                    content = json.dumps(content)
+                data = content.encode('utf-8')
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n" %
+                              (status, SERVER_STATUS_REASONS[status], len(data), '' if keep_alive else 'Connection: close\r\n')).encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, query, body):
+        """
+        Returns (HTTP status, JSON-able content or a JSON string) for a request
+        """
+        import asyncio
+        import json
+        global logger
+
+        try:
+            request = json.loads(body) if body and path != '/import' else {}
+        except ValueError:
+            return (400, {'error': 'request body is not JSON'})
+        if not isinstance(request, dict):
+            return (400, {'error': 'request body is not a JSON object'})
+
+        try:
+            if method == 'GET' and path == '/learners':
+                learners = await self.query(lambda cur, conn: get_learners(cur))
+                return (200, {'learners': learners})
+
+            if method == 'POST' and path == '/batch':
+                num_of_words, learner_id = check_size(request.get('size', WORDS_PER_BATCH)), int(request.get('learner_id', DEFAULT_LEARNER_ID))
+                await self.query(lambda cur, conn: check_learner(cur, learner_id))
+                phrases = await self.query(lambda cur, conn: get_phrase_batch(cur, conn, num_of_words, learner_id), write=True)
+                if phrases == None:
+                    return (500, {'error': 'could not start a batch'})
+                return (200, {'batch_id': phrases.batch_id, 'phrases': list(zip(phrases.phrase_ids, phrases.texts))})
+
+            if method == 'POST' and path == '/batch/reschedule':
+                batch_id, num_of_words, learner_id = int(request['batch_id']), check_size(request.get('size', WORDS_PER_BATCH)), int(request['learner_id'])
+                # The batch moves to learner_id, so it may belong to anyone,
+                # but only before it is finished
+                await self.query(lambda cur, conn: check_learner(cur, learner_id) or check_batches(cur, [(batch_id, None)], unfinished=True))
+                phrases = await self.query(lambda cur, conn: reschedule_phrase_batch(cur, conn, phrase_batch(batch_id), num_of_words, learner_id), write=True)
+                return (200, {'batch_id': phrases.batch_id, 'phrases': list(zip(phrases.phrase_ids, phrases.texts))})
+
+            if method == 'POST' and path == '/batch/window':
+                num_of_words, learner_id, exclude = check_size(request['size']), int(request['learner_id']), set(request.get('exclude', []))
+                await self.query(lambda cur, conn: check_learner(cur, learner_id))
+                rows = await self.query(lambda cur, conn: get_phrase_window(cur, num_of_words, learner_id, exclude))
+                return (200, {'phrases': rows})
+
+            if method == 'POST' and path == '/responses':
+                responses = [check_response(response) for response in request['responses']]
+                batches = set((response[0], response[6]) for response in responses)
+                await self.query(lambda cur, conn: check_batches(cur, batches))
+                # log() blocks when the writer falls behind, so don't do it on the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.log_responses, responses)
+                return (200, {'queued': len(responses)})
+
+            if method == 'POST' and path == '/batch/finish':
+                batch_id = int(request['batch_id'])
+                await self.query(lambda cur, conn: check_batches(cur, [(batch_id, None)]))
+                # The batch's answers are all in before it is marked finished
+                await asyncio.get_running_loop().run_in_executor(None, self.responses.flush)
+                await self.query(lambda cur, conn: finish_batch(cur, conn, batch_id))
+                return (200, {'batch_id': batch_id})
+
+            if method == 'GET' and path == '/phrases':
+                enabled = {'1': True, '0': False}.get(query.get('enabled'))
+                filters = {'list_name': query.get('list'), 'enabled': enabled, 'pattern': query.get('pattern'),
+                           'min_id': int(query['min_id']) if 'min_id' in query else None,
+                           'max_id': int(query['max_id']) if 'max_id' in query else None}
+                return (200, await self.query(lambda cur, conn: list_phrases_json(cur, **filters)))
+
+            if method == 'POST' and path == '/import':
+                result = await self.query(lambda cur, conn: import_phrases_text(cur, conn, body.decode('utf-8')), write=True)
+                if result == None:
+                    return (400, {'error': 'could not import phrases; see the server log'})
+                return (200, {'inserted': result[0], 'skipped': result[1]})
+        except (KeyError, TypeError, ValueError) as e:
+            return (400, {'error': 'bad request: %s' % e})
+        except sqlite3.Error as e:
+            logger.error("Database error serving %s %s: %s", method, path, e)
+            return (500, {'error': 'database error'})
+
+        return (404, {'error': 'no such endpoint'})
+
+    def log_responses(self, responses):
+        for response in responses:
+            self.responses.log(*response)
+
+def check_response(response):
+    """
+    Checks that an answer sent to POST /responses is a list of the seven
+    fields response_writer.log() takes: integer batch and phrase ids,
+    answer, render and input times that are numbers or null, Correct or
+    Incorrect, and an integer learner id. Raises ValueError if not, so one
+    kiosk's bad answer never reaches the writer
+    Returns the answer as a tuple
+    """
+    import math
+
+    if not isinstance(response, list) or len(response) != 7:
+        raise ValueError("an answer must be a list of 7 fields")
+    batch_id, phrase_id, time_to_result, result, render_to_flip_ms, flip_to_input_ms, learner_id = response
+    for name, value in (('batch_id', batch_id), ('phrase_id', phrase_id), ('learner_id', learner_id)):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError("%s must be an integer" % name)
+    for name, value in (('answer time', time_to_result), ('render_to_flip_ms', render_to_flip_ms), ('flip_to_input_ms', flip_to_input_ms)):
+        if value == None:
+            continue
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise ValueError("%s must be a number or null" % name)
+    if result not in ("Correct", "Incorrect"):
+        raise ValueError("answer status must be Correct or Incorrect")
+    return tuple(response)
+
+def check_size(size):
+    """
+    Checks that a number of phrases asked for is between 1 and
+    SERVER_MAX_WORDS. Raises ValueError if not
+    Returns the number as an int
+    """
+    size = int(size)
+    if size < 1 or size > SERVER_MAX_WORDS:
+        raise ValueError("size must be between 1 and %d" % SERVER_MAX_WORDS)
+    return size
+
+def check_learner(cur, learner_id):
+    """
+    Raises ValueError unless learner_id is a learner in the database
+    """
+    cur.execute('SELECT 1 FROM learners WHERE learner_id = ?', (learner_id,))
+    if cur.fetchone() == None:
+        raise ValueError("no learner %s" % learner_id)
+
+def check_batches(cur, batches, unfinished=False):
+    """
+    Checks each (batch_id, learner_id) in batches: the batch must exist and
+    have been started for learner_id (any learner if learner_id is None),
+    and with unfinished, not have been finished. Raises ValueError if not
+    """
+    for batch_id, learner_id in batches:
+        cur.execute('SELECT learner_id, end_time FROM batches WHERE batch_id = ?', (batch_id,))
+        row = cur.fetchone()
+        if row == None:
+            raise ValueError("no batch %s" % batch_id)
+        if learner_id != None and row[0] != learner_id:
+            raise ValueError("batch %s does not belong to learner %s" % (batch_id, learner_id))
+        if unfinished and row[1] != None:
+            raise ValueError("batch %s is already finished" % batch_id)
+
+def list_phrases_json(cur, **filters):
+    """
+    Returns the phrases matching filters (see phrase_filter()) as the JSON
+    text --list-phrases --format json prints
+    """
+    import io
+    output = io.StringIO()
+    list_phrases(cur, output, 'json', **filters)
+    return output.getvalue()
+
+def import_phrases_text(cur, conn, csv_text):
+    """
+    Imports phrases from CSV text, by way of a temporary file
+    Returns what import_phrases() returned
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file_name = directory + os.sep + 'import.csv'
+        with open(csv_file_name, 'w', newline='') as csv_file:
+            csv_file.write(csv_text)
+        return import_phrases(cur, conn, csv_file_name)
+
+def serve_sessions(curr_loc, address):
+    """
+    Runs a session_server until interrupted
+    Returns 1 once stopped, or None if the server could not start
+    """
+    import asyncio
+    global logger
+
+    host, port = parse_server_address(address)
     try:
-        import csv
-    except:
-        logger.error("Error importing CSV module")
+        if asyncio.run(session_server(curr_loc).serve(host, port)) == False:
+            return None
+    except KeyboardInterrupt:
+        logger.info("Session server stopped")
+    return 1
 
-    #try:
-    logger.debug("Opening file: %s" % arguments.import_phrases)
-    with open(arguments.import_phrases) as csvfile:
-        logger.debug("Initializing DictReader for CSV")
-        reader = csv.DictReader(csvfile)
-        logger.debug("Iterating through file")
-        for row in reader:
-            logger.debug("Working with line: %s" % row)
-            logger.debug("Adding phrase to database")
-            try:
-                phrase = row['phrase']
-            except:
-                logger.error("Import file not properly formatted, no 'phrase' column found with appropriate identification in first row")
-                quit_sightright(1)
+class session_client:
+    """
+    Talks to a session_server for a kiosk run with --connect, over one
+    persistent HTTP connection. Each thread needs its own session_client.
+    Methods mirror the database functions the game uses, and return None
+    (after logging why) if the server can't be reached or refuses
+    """
 
+    def __init__(self, address, timeout=SERVER_CLIENT_TIMEOUT):
+        import http.client
+        host, port = parse_server_address(address)
+        self.address = address
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, payload=None, body=None):
+        """
+        Sends a request, with payload as JSON or body as it is
+        Returns the decoded JSON reply, or None on failure
+        """
+        import http.client
+        import json
+        global logger
+
+        if payload != None:
+            body = json.dumps(payload).encode('utf-8')
+        # A kept-alive connection the server has since closed fails on first
+        # use; try once more on a fresh one
+        for attempt in range(2):
             try:
-                list = row['list']
-            except:
-                logger.error("Import file not properly formatted, no 'list' column found with appropriate identification in first row")
-                quit_sightright(1)
+                self.connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                response = self.connection.getresponse()
+                content = json.loads(response.read())
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.connection.close()
+                if attempt == 1:
+                    logger.error("Lost the connection to the session server at %s", self.address)
+                    return None
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self.connection.close()
+                logger.error("Could not reach the session server at %s: %s", self.address, e)
+                return None
+        if response.status != 200:
+            logger.error("Session server refused %s %s: %s", method, path, content.get('error') if isinstance(content, dict) else response.status)
+            return None
+        return content
+
+    def get_learners(self):
+        result = self.request('GET', '/learners')
+        if result == None:
+            return None
+        return [tuple(learner) for learner in result['learners']]
+
+    def get_learner_id(self, name):
+        for learner_id, learner_name in self.get_learners() or []:
+            if learner_name == name:
+                return learner_id
+        return None
 
-            try:
-                logger.debug("Adding phrase to database; phrase=%s list=%s" % (phrase,list))
-                result = add_phrase_to_database(cursor, connection, row['phrase'], row['list'])
-            except:
-                logger.error("Error adding phrase to database")
-                quit_sightright(1)
+    def phrase_batch_from(self, result):
+        if result == None:
+            return None
+        phrases = phrase_batch(result['batch_id'])
+        phrases.extend_from_rows(result['phrases'])
+        return phrases
 
-            logger.debug(result)
-            if result != None:
-                logger.debug("Successfully added '%s' to database with id '%s'" % (row['phrase'], result))
-            else:
-                logger.warning("Skipped adding '%s' to database" % row['phrase'])
-    #except e:
-    #    print(e)
-    #logger.error("Something bad happened")
-    quit_sightright(0)
+    def get_phrase_batch(self, num_of_words, learner_id=DEFAULT_LEARNER_ID):
+        return self.phrase_batch_from(self.request('POST', '/batch', {'size': num_of_words, 'learner_id': learner_id}))
+
+    def reschedule_phrase_batch(self, phrases, num_of_words, learner_id):
+        return self.phrase_batch_from(self.request('POST', '/batch/reschedule', {'batch_id': phrases.batch_id, 'size': num_of_words, 'learner_id': learner_id}))
+
+    def get_phrase_window(self, num_of_words, learner_id, exclude):
+        result = self.request('POST', '/batch/window', {'size': num_of_words, 'learner_id': learner_id, 'exclude': list(exclude)})
+        if result == None:
+            return None
+        return [tuple(row) for row in result['phrases']]
+
+    def finish_batch(self, batch_id):
+        return self.request('POST', '/batch/finish', {'batch_id': batch_id})
+
+    def record_responses(self, responses):
+        return self.request('POST', '/responses', {'responses': responses})
+
+    def list_phrases(self, **filters):
+        """
+        Returns the phrases matching filters (see phrase_filter()) as a list
+        of dictionaries, like --format json prints
+        """
+        import urllib.parse
+        query = {'list': filters.get('list_name'), 'pattern': filters.get('pattern'), 'min_id': filters.get('min_id'), 'max_id': filters.get('max_id'),
+                 'enabled': {True: 1, False: 0}.get(filters.get('enabled'))}
+        return self.request('GET', '/phrases?' + urllib.parse.urlencode(dict((key, value) for key, value in query.items() if value != None)))
+
+    def import_phrases(self, csv_file_name):
+        with open(csv_file_name, 'rb') as csv_file:
+            result = self.request('POST', '/import', body=csv_file.read())
+        if result == None:
+            return None
+        return (result['inserted'], result['skipped'])
+
+class remote_response_writer(response_writer):
+    """
+    A response_writer that sends answers to a session_server instead of the
+    local database, still batched up and off the game loop
+    """
 
-if arguments.list_phrases:
-    logger.debug("Option invoked: --list-phrases")
-    #try:
-    logger.debug("Getting all phrases from database")
-    phrases_to_list = get_all_phrases(cursor, connection)
-    logger.debug("Got %s phrases from database" % len(phrases_to_list))
-    for phrase in phrases_to_list:
-        print(phrase)
-    #except:
-    #    logger.warning("Unexpected error")
-    quit_sightright(0)
+    def __init__(self, address, queue_size=RESPONSE_QUEUE_SIZE):
+        self.address = address
+        response_writer.__init__(self, None, queue_size)
+
+    def connect(self):
+        self.client = session_client(self.address)
+        return True
+
+    def write(self, responses):
+        # Keep trying for a while rather than lose answers if the server is
+        # briefly away, but not once the game is on its way out
+        give_up_time = time.monotonic() + SERVER_WRITE_RETRY_SECONDS
+        while True:
+            if self.client.record_responses(responses) != None:
+                return
+            if time.monotonic() >= give_up_time or self.closing.wait(1):
+                break
+        # run() logs each answer that was lost
+        raise ConnectionError("gave up sending %d answers to the session server" % len(responses))
+
+    def abort(self, responses):
+        # The server commits each request whole, so there is nothing to undo
+        pass
 
-if arguments.disable_phrase_id:
-    logger.debug("Attempting to disable phrase id %s" % arguments.disable_phrase_id)
-    try:
-        logger.debug("Calling disable_phrase()")
-        result=disable_phrase(cursor, connection, arguments.disable_phrase_id)
-        if result == 1:
-            # Successful
-            logger.info("Successfully disabled phrase with id %s" % arguments.disable_phrase_id)
+    def disconnect(self):
+        self.client.connection.close()
+
+class remote_phrase_window_fetcher(phrase_window_fetcher):
+    """
+    A phrase_window_fetcher that fetches phrases from a session_server. Font
+    sizes are still kept in the local database
+    """
+
+    def __init__(self, curr_loc, address):
+        self.address = address
+        phrase_window_fetcher.__init__(self, curr_loc)
+
+    def connect(self):
+        self.client = session_client(self.address)
+        return phrase_window_fetcher.connect(self)
+
+    def fetch(self, num_of_words, learner_id, exclude):
+        return self.client.get_phrase_window(num_of_words, learner_id, exclude)
+
+    def disconnect(self):
+        self.client.connection.close()
+        phrase_window_fetcher.disconnect(self)
+
+# End function definitions
+
+# Set up argument parser
+parser = argparse.ArgumentParser(description='A flash card game for parents and children to play together')
+
+parser.add_argument('-l', '--list-phrases',
+                    action="store_const", const="list_phrases",
+                    dest="list_phrases",
+                    help='List phrases stored in the database')
+
+parser.add_argument('--list-name',
+                    action="store",
+                    dest="list_name",
+                    help='Only pick phrases from this list (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--enabled-only',
+                    action="store_const",
+                    const=1,
+                    dest="enabled_filter",
+                    help='Only pick enabled phrases (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--disabled-only',
+                    action="store_const",
+                    const=0,
+                    dest="enabled_filter",
+                    help='Only pick disabled phrases (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--min-id',
+                    action="store",
+                    type=int,
+                    dest="min_id",
+                    help='Only pick phrases with at least this id (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--max-id',
+                    action="store",
+                    type=int,
+                    dest="max_id",
+                    help='Only pick phrases with at most this id (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--format',
+                    action="store",
+                    choices=['text', 'csv', 'json'],
+                    default='text',
+                    dest="output_format",
+                    help='Output format for --list-phrases (default: text)')
+
+parser.add_argument('-i', '--import-phrases',
+                    action="store", dest="import_phrases",
+                    help='Import a CSV file of phrases into the database')
+
+# Only one change to the phrases at a time
+phrase_change_group = parser.add_mutually_exclusive_group()
+
+phrase_change_group.add_argument('-d', '--disable-phrase',
+                    action="store",
+                    nargs='?',
+                    const='',
+                    dest="disable_phrase_id",
+                    help='Disable phrases by id (e.g. 3 or 3,7,10-20), and/or those picked by --list-name, --pattern, --min-id and --max-id')
+
+phrase_change_group.add_argument('-e', '--enable-phrase',
+                    action="store",
+                    nargs='?',
+                    const='',
+                    dest="enable_phrase_id",
+                    help='Enable phrases by id (e.g. 3 or 3,7,10-20), and/or those picked by --list-name, --pattern, --min-id and --max-id')
+
+phrase_change_group.add_argument('-r', '--remove-phrase',
+                    action="store",
+                    nargs='?',
+                    const='',
+                    dest="remove_phrase_id",
+                    help='Remove phrases by id (e.g. 3 or 3,7,10-20), and/or those picked by --list-name, --pattern, --min-id and --max-id, from the database')
+
+parser.add_argument('--pattern',
+                    action="store",
+                    dest="pattern",
+                    help='Only pick phrases matching this glob pattern, e.g. "th*" (with --list-phrases, -d, -e or -r)')
+
+parser.add_argument('--dry-run',
+                    action="store_const",
+                    const=True,
+                    dest="dry_run",
+                    help='Report how many phrases -d, -e or -r would change without changing them')
+
+parser.add_argument('--learner',
+                    action="store",
+                    dest="learner",
+                    help='Play as (or report --phrase-stats or --analytics for) this learner')
+
+parser.add_argument('--add-learner',
+                    action="store",
+                    dest="add_learner",
+                    help='Add a learner profile')
+
+parser.add_argument('--list-learners',
+                    action="store_const",
+                    const=True,
+                    dest="list_learners",
+                    help='List learner profiles')
+
+parser.add_argument('--phrase-stats',
+                    action="store_const",
+                    const=True,
+                    dest="phrase_stats",
+                    help='Report answer counts, accuracy and answer times for each phrase')
+
+parser.add_argument('--archive-before',
+                    action="store",
+                    dest="archive_before",
+                    metavar="YYYY-MM-DD",
+                    help='Move answers from rounds played before this date (UTC) out of the database into archive/%s' % ARCHIVE_FILE_NAME)
+
+parser.add_argument('--bake-atlas',
+                    action="store_const",
+                    const=True,
+                    dest="bake_atlas",
+                    help='Pre-render every enabled phrase into %s, so the game can draw them without rendering' % ATLAS_FILE_NAME)
+
+parser.add_argument('--analytics',
+                    action="store_const",
+                    const=True,
+                    dest="analytics",
+                    help='Rank phrases by answer time z-score and show recent batch trends (needs NumPy)')
+
+parser.add_argument('--words',
+                    action="store",
+                    dest="words_per_batch",
+                    type=int,
+                    default=WORDS_PER_BATCH,
+                    metavar="N",
+                    help='Number of words in a round (default %(default)s)')
+
+parser.add_argument('--endless',
+                    action="store_const",
+                    const=True,
+                    dest="endless",
+                    help='Keep asking words until Esc or q is pressed, fetching %d at a time' % ENDLESS_WINDOW_SIZE)
+
+parser.add_argument('--serve',
+                    action="store",
+                    dest="serve",
+                    nargs='?',
+                    const=SERVER_DEFAULT_ADDRESS,
+                    metavar="[HOST:]PORT",
+                    help='Serve this database to kiosks run with --connect (default %s)' % SERVER_DEFAULT_ADDRESS)
+
+parser.add_argument('--connect',
+                    action="store",
+                    dest="connect",
+                    metavar="[HOST:]PORT",
+                    help='Play, list or import phrases using the database of a SightRight run with --serve')
+
+parser.add_argument('--check-database',
+                    action="store_const",
+                    const=True,
+                    dest="check_database",
+                    help='Report the database schema version and check that lookups use indexes')
+
+parser.add_argument('--poll-loop',
+                    action="store_const",
+                    const=True,
+                    dest="poll_loop",
+                    help='Poll for input 60 times a second instead of waiting for events (the old game loop)')
+
+parser.add_argument('--measure-cpu',
+                    action="store_const",
+                    const=True,
+                    dest="measure_cpu",
+                    help='Report the wall clock and CPU time spent in each game state on exit')
+
+parser.add_argument('--profile',
+                    action="store_const",
+                    const=True,
+                    dest="profile",
+                    help='Time each game state, frame and database call, and write a summary to the logs folder on exit')
+
+parser.add_argument('--cprofile',
+                    action="store",
+                    dest="cprofile_file_name",
+                    metavar="FILE",
+                    help='Run the game under cProfile and write its statistics to FILE on exit (read them with python3 -m pstats)')
+
+parser.add_argument('--synchronous',
+                    action="store",
+                    dest="synchronous",
+                    choices=DATABASE_SYNCHRONOUS_LEVELS,
+                    type=str.upper,
+                    default=database_synchronous,
+                    help='How carefully each database commit is flushed to disk (default %(default)s)')
+
+parser.add_argument('--log',
+                    action="store_const",
+                    const=True,
+                    dest="logging_enabled",
+                    help='Enable text logs of runtime (mostly for debugging)')
+
+parser.add_argument('--debug',
+                    action="store_const",
+                    const=True,
+                    dest="debug",
+                    help='Enable debug output, for more verbosity')
+
+# Begin main execution
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+
+    # Implicitly turn on text logs if --debug is enabled
+    # Explicitly turn on text logs if --log is enabled
+    if arguments.debug or debug_on or arguments.logging_enabled:
+        logging_enabled = True
+    else:
+        logging_enabled = False
+
+    if arguments.debug:
+        debug_on = True
+
+    if arguments.poll_loop:
+        poll_loop = True
+
+    if arguments.measure_cpu:
+        measure_cpu = True
+
+    if arguments.profile:
+        profiling = True
+
+    database_synchronous = arguments.synchronous
+
+    if arguments.words_per_batch < 1:
+        parser.error("--words must be at least 1")
+
+    if arguments.connect:
+        # These work on the local database, which a kiosk playing with
+        # --connect doesn't use; they have to be run on the session server
+        local_options = [option for option, given in (('--disable-phrase', arguments.disable_phrase_id != None),
+                                                      ('--enable-phrase', arguments.enable_phrase_id != None),
+                                                      ('--remove-phrase', arguments.remove_phrase_id != None),
+                                                      ('--add-learner', arguments.add_learner),
+                                                      ('--phrase-stats', arguments.phrase_stats),
+                                                      ('--analytics', arguments.analytics),
+                                                      ('--archive-before', arguments.archive_before)) if given]
+        if local_options:
+            parser.error("%s can't be used with --connect; run it where the session server's database is" % ', '.join(local_options))
+    words_per_batch = arguments.words_per_batch
+    if arguments.endless:
+        endless_mode = True
+        # An endless round starts with one window, and grows as it goes
+        words_per_batch = ENDLESS_WINDOW_SIZE
+
+    setup_logging()
+
+    # Set the logging level to debug if --debug was specified
+    #if arguments.debug or debug_on:
+
+    if does_database_exist(current_directory):
+        # Database was found
+        logger.debug("Database file is present")
+        connection = connect_database(current_directory)
+
+        if not connection:
+            # Error connecting to database
+            logger.error("Could not connect to SightRight database file!")
+            quit_sightright(CANNOT_CONNECT_TO_DATABASE)
         else:
-            # Failed
-            logger.warning("Failed to disable phrase with id %s" % arguments.disable_phrase_id)
-    except:
-        logger.error("Unexpected error occurred")
-        quit_sightright(1)
-    quit_sightright(0)
-if arguments.remove_phrase_id:
-    logger.debug("Attempting to remove phrase id %s" % arguments.remove_phrase_id)
-    try:
-        logger.debug("Calling delete_phrase()")
-        result=delete_phrase(cursor, connection, arguments.remove_phrase_id)
-        if result == 1:
-            # Successful
-            logger.info("Successfully removed phrase with id %s" % arguments.remove_phrase_id)
+            # Database connection successful
+            logger.debug("Database connection successful")
+            cursor = connection.cursor()
+            if not setup_database(cursor, connection):
+                logger.critical("Could not bring the SightRight database up to date!")
+                quit_sightright(CANNOT_MIGRATE_DATABASE)
+    else:
+        # Database was not found
+        logger.info("SightRight database missing. Creating...")
+
+        # Create the database
+        connection = connect_database(current_directory)
+
+        if not connection:
+            # Error connecting to newly-created database
+            logger.critical("Could not connect to SightRight database file!")
+            quit_sightright(CANNOT_CONNECT_TO_DATABASE)
         else:
-            # Failed
-            logger.warning("Failed to remove phrase with id %s" % arguments.remove_phrase_id)
-    except:
-        logger.error("Unexpected error occurred")
+            # Successful creating and connecting to database
+            logger.info("SightRight database created")
+            cursor = connection.cursor()
+            if not setup_database(cursor, connection):
+                logger.critical("Could not set up the SightRight database!")
+                quit_sightright(CANNOT_MIGRATE_DATABASE)
+            logger.info("Database setup complete")
+
+    if arguments.archive_before:
+        logger.debug("Option invoked: --archive-before")
+        try:
+            time.strptime(arguments.archive_before, '%Y-%m-%d')
+        except ValueError:
+            logger.error("Could not understand date '%s'; expected YYYY-MM-DD", arguments.archive_before)
+            quit_sightright(1)
+        archive_file_name = get_archive_file_name(current_directory)
+        result = archive_responses(cursor, connection, arguments.archive_before, archive_file_name)
+        if result == None:
+            quit_sightright(1)
+        logger.info("Archived %d answers to %s", result, archive_file_name)
+        quit_sightright(0)
+
+    if arguments.bake_atlas:
+        logger.debug("Option invoked: --bake-atlas")
+        bake_atlas(cursor, connection, get_atlas_file_name(current_directory))
+        quit_sightright(0)
+
+    if arguments.check_database:
+        logger.debug("Option invoked: --check-database")
+        logger.info("Database schema version: %d", get_schema_version(cursor))
+        if verify_query_plans(cursor) > 0:
+            quit_sightright(1)
+        logger.info("All hot queries are served by an index")
+        quit_sightright(0)
+
+    if arguments.serve:
+        logger.debug("Option invoked: --serve")
+        if serve_sessions(current_directory, arguments.serve) == None:
+            quit_sightright(CANNOT_CONNECT_TO_DATABASE)
+        quit_sightright(0)
+
+    if arguments.connect:
+        logger.debug("Option invoked: --connect")
+        server_session = session_client(arguments.connect)
+
+    if arguments.add_learner:
+        logger.debug("Option invoked: --add-learner")
+        if add_learner(cursor, connection, arguments.add_learner) == None:
+            quit_sightright(1)
+        logger.info("Added learner '%s'", arguments.add_learner)
+        quit_sightright(0)
+
+    if arguments.list_learners:
+        logger.debug("Option invoked: --list-learners")
+        if server_session != None:
+            listed = server_session.get_learners()
+            if listed == None:
+                quit_sightright(CANNOT_CONNECT_TO_DATABASE)
+        else:
+            listed = get_learners(cursor)
+        for learner_id, name in listed:
+            print("id: %s  |  name: %s" % (learner_id, name))
+        quit_sightright(0)
+
+    learner_id = DEFAULT_LEARNER_ID
+    if arguments.learner:
+        if server_session != None:
+            learner_id = server_session.get_learner_id(arguments.learner)
+        else:
+            learner_id = get_learner_id(cursor, arguments.learner)
+        if learner_id == None:
+            logger.error("There is no learner called '%s'; add one with --add-learner", arguments.learner)
+            quit_sightright(1)
+
+    if arguments.phrase_stats:
+        logger.debug("Option invoked: --phrase-stats")
+        report_phrase_stats(cursor, learner_id)
+        quit_sightright(0)
+
+    if arguments.analytics:
+        logger.debug("Option invoked: --analytics")
+        if report_analytics(cursor, learner_id) == None:
+            quit_sightright(1)
+        quit_sightright(0)
+
+    if arguments.import_phrases and server_session != None:
+        logger.debug("Option invoked: --import-phrases (on the session server)")
+        result = server_session.import_phrases(arguments.import_phrases)
+        if result == None:
+            quit_sightright(1)
+        logger.info("Session server imported %d phrases, skipped %d", result[0], result[1])
+        quit_sightright(0)
+
+    if arguments.import_phrases:
+        logger.debug("Option invoked: --import-phrases")
+        result = import_phrases(cursor, connection, arguments.import_phrases)
+        if result == None:
+            quit_sightright(1)
+        quit_sightright(0)
+
+    if arguments.list_phrases and server_session != None:
+        logger.debug("Option invoked: --list-phrases (on the session server)")
+        import json
+        listed = server_session.list_phrases(list_name=arguments.list_name,
+                                             enabled=arguments.enabled_filter,
+                                             min_id=arguments.min_id,
+                                             max_id=arguments.max_id,
+                                             pattern=arguments.pattern)
+        if listed == None:
+            quit_sightright(1)
+        # Phrases come back from the server as JSON, so they are listed as JSON
+        sys.stdout.write('[' + ','.join('\n  ' + json.dumps(phrase_fields) for phrase_fields in listed) + '\n]\n')
+        quit_sightright(0)
+
+    if arguments.list_phrases:
+        logger.debug("Option invoked: --list-phrases")
+        listed = list_phrases(cursor, sys.stdout, arguments.output_format,
+                              list_name=arguments.list_name,
+                              enabled=arguments.enabled_filter,
+                              min_id=arguments.min_id,
+                              max_id=arguments.max_id,
+                              pattern=arguments.pattern)
+        logger.debug("Listed %s phrases", listed)
+        quit_sightright(0)
+
+    for phrase_ids, action, done in ((arguments.disable_phrase_id, 'disable', 'disabled'),
+                                     (arguments.enable_phrase_id, 'enable', 'enabled'),
+                                     (arguments.remove_phrase_id, 'remove', 'removed')):
+        if phrase_ids == None:
+            continue
+        logger.debug("Option invoked: %s phrases %s", action, phrase_ids)
+        try:
+            id_ranges = parse_id_ranges(phrase_ids) if phrase_ids else None
+        except ValueError:
+            logger.error("Could not understand phrase ids '%s'; expected something like 3 or 3,7,10-20", phrase_ids)
+            quit_sightright(1)
+        result = change_phrases(cursor, connection, action, arguments.dry_run,
+                                list_name=arguments.list_name,
+                                enabled=arguments.enabled_filter,
+                                min_id=arguments.min_id,
+                                max_id=arguments.max_id,
+                                id_ranges=id_ranges,
+                                pattern=arguments.pattern)
+        if result == None:
+            quit_sightright(1)
+        if arguments.dry_run:
+            logger.info("Would have %s %d phrases", done, result)
+        elif result == 0:
+            logger.warning("No phrases matched; nothing %s", done)
+        else:
+            logger.info("Successfully %s %d phrases", done, result)
+        quit_sightright(0)
+
+    load_pygame()
+    logger.debug("Initializing pygame")
+    pygame.init()
+    logger.debug("Initializing clock")
+    game_clock = pygame.time.Clock()
+
+    logger.debug("Setting display mode")
+    game_display = pygame.display.set_mode((display_width,display_height))
+    logger.debug("Setting window caption")
+    pygame.display.set_caption('Flash Cards')
+    # Only wake the game loop for events it acts on, not mouse movement etc.
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.USEREVENT + 1])
+    #global clock
+    #clock = pygame.time.Clock()
+    logger.debug("Initializing font")
+    controls_font = pygame.font.Font('freesansbold.ttf', 20)
+    phrase_atlas = open_atlas(get_atlas_file_name(current_directory))
+
+    if server_session != None:
+        learners = server_session.get_learners()
+        if learners == None:
+            quit_sightright(CANNOT_CONNECT_TO_DATABASE)
+        phrases = server_session.get_phrase_batch(words_per_batch, learner_id)
+    else:
+        learners = get_learners(cursor)
+        phrases = get_phrase_batch(cursor, connection, words_per_batch, learner_id)
+    if phrases == None:
+        logger.error("Could not start a batch")
+        quit_sightright(1)
+    current_learner = [learner[0] for learner in learners].index(learner_id)
+
+    total_words = len(phrases)
+    current_phrase_number = 0
+    score = 0
+    words_attempted = 0
+
+    if total_words <= 0:
+        logger.warning("No phrases returned from database; database likely empty")
+        logger.warning("Quitting")
         quit_sightright(1)
-    quit_sightright(0)
 
-logger.debug("Initializing pygame")
-pygame.init()
-logger.debug("Initializing clock")
-game_clock = pygame.time.Clock()
-
-logger.debug("Setting display mode")
-game_display = pygame.display.set_mode((display_width,display_height))
-logger.debug("Setting window caption")
-pygame.display.set_caption('Flash Cards')
-#global clock
-#clock = pygame.time.Clock()
-logger.debug("Initializing font")
-sight_word_font = pygame.font.Font('freesansbold.ttf', 115)
-controls_font = pygame.font.Font('freesansbold.ttf', 20)
-
-phrases = get_phrase_batch(cursor, connection, 30)
-
-total_words = len(phrases)
-current_phrase_number = 0
-score = 0
-words_attempted = 0
-
-if total_words <= 0:
-    logger.warning("No phrases returned from database; database likely empty")
-    logger.warning("Quitting")
-    quit_sightright(1)
-
-current_phrase = phrases[current_phrase_number]
-
-logger.debug("Setting state to BATCH_START")
-game_state = BATCH_START
-# Update the display now before starting the loop
-# Otherwise we need an update_display() call in the loop for BATCH_START
-# which makes it unnecessarily chatty in the debug logs
-update_display()
-
-#logger.debug("Current word is: %s" % current_phrase.text)
-
-logger.debug("Starting game loop")
-game_loop()
-#pygame.quit()
-quit_sightright(0)
+    current_phrase = phrases[current_phrase_number]
+    logger.debug("Loading font sizes for the batch")
+    load_phrase_font_sizes(cursor, connection, phrases.texts)
+    if endless_mode:
+        endless_batch_id = phrases.batch_id
+
+    logger.debug("Starting background response writer")
+    if server_session != None:
+        response_log = remote_response_writer(arguments.connect)
+    else:
+        response_log = response_writer(current_directory)
+    if not response_log.connected:
+        logger.critical("Could not open the database for recording answers!")
+        quit_sightright(CANNOT_CONNECT_TO_DATABASE)
+    if endless_mode:
+        logger.debug("Starting background phrase window fetcher")
+        if server_session != None:
+            window_fetcher = remote_phrase_window_fetcher(current_directory, arguments.connect)
+        else:
+            window_fetcher = phrase_window_fetcher(current_directory)
+        if not window_fetcher.connected:
+            logger.critical("Could not open the database for fetching phrases!")
+            quit_sightright(CANNOT_CONNECT_TO_DATABASE)
+
+    logger.debug("Setting state to BATCH_START")
+    game_state = BATCH_START
+    # Update the display now before starting the loop
+    # Otherwise we need an update_display() call in the loop for BATCH_START
+    # which makes it unnecessarily chatty in the debug logs
+    update_display()
+
+    #logger.debug("Current word is: %s", current_phrase.text)
+
+    if arguments.cprofile_file_name:
+        logger.debug("Starting cProfile")
+        import cProfile
+        cprofile_file_name = arguments.cprofile_file_name
+        cprofile_profiler = cProfile.Profile()
+        cprofile_profiler.enable()
+
+    logger.debug("Starting game loop")
+    game_loop()
+    #pygame.quit()
+    quit_sightright(0)